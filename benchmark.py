@@ -1,13 +1,27 @@
 #!/usr/bin/env python3
 
 import time
+import argparse
 import numpy as np
 import gym
 import gym_miniworld
+from gym_miniworld.opengl import get_backend_name, enable_gl_call_count, get_gl_call_count
+from gym_miniworld.batched import BatchedMiniWorld
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--env-name', default='MiniWorld-Maze-v0')
+parser.add_argument('--fb-profile', default=None, help='observation frame buffer profile (quality, balanced, fast)')
+parser.add_argument('--num-envs', type=int, default=1, help='also benchmark a BatchedMiniWorld with this many envs')
+parser.add_argument('--no-atlas', action='store_true', help='read back the batched observations one env at a time')
+args = parser.parse_args()
+
+env_kwargs = {}
+if args.fb_profile:
+    env_kwargs['obs_fb_profile'] = args.fb_profile
 
 # Benchmark loading time
 st = time.time()
-env = gym.make('MiniWorld-Maze-v0')
+env = gym.make(args.env_name, **env_kwargs)
 env.seed(0)
 env.reset()
 load_time = 1000 * (time.time() - st)
@@ -40,10 +54,53 @@ while True:
 fps = num_frames / dt
 frame_time = 1000 * dt / num_frames
 
+# Count the OpenGL calls made per step, separately, as counting slows them down
+enable_gl_call_count()
+get_gl_call_count(reset=True)
+for i in range(100):
+    obs, reward, done, info = env.step(0)
+    if done:
+        env.reset()
+gl_calls = get_gl_call_count() / 100
+enable_gl_call_count(False)
+
 print()
+print('gl backend: {}'.format(get_backend_name()))
 print('load time: {} ms'.format(int(load_time)))
 print('reset time: {:,.1f} ms'.format(reset_time))
 print('frame time: {:,.1f} ms'.format(frame_time))
 print('frame rate: {:,.1f} FPS'.format(fps))
+print('gl calls per step: {:,.1f}'.format(gl_calls))
 
 env.close()
+
+if args.num_envs > 1:
+    # Benchmark batched rendering of the observations of many envs
+    batch = BatchedMiniWorld(
+        args.env_name,
+        args.num_envs,
+        use_atlas=not args.no_atlas,
+        **env_kwargs
+    )
+    batch.seed(0)
+    batch.reset()
+
+    actions = np.zeros(args.num_envs, dtype=int)
+    num_steps = 0
+    st = time.time()
+
+    while True:
+        dt = time.time() - st
+
+        if dt > 5:
+            break
+
+        batch.step(actions)
+        num_steps += 1
+
+    print('batched frame rate: {:,.1f} FPS ({} envs)'.format(
+        num_steps * args.num_envs / dt,
+        args.num_envs
+    ))
+
+    batch.close()
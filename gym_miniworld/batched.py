@@ -0,0 +1,164 @@
+import numpy as np
+import gym
+from gym import spaces
+from .miniworld import MiniWorldEnv
+from .opengl import *
+
+class BatchedMiniWorld:
+    """
+    Run many instances of a MiniWorld environment in the same process,
+    rendering the observations of all of them in a single pass.
+
+    All the environments share the same OpenGL context and textures.
+    Each one draws its observation into its own tile of a large atlas
+    frame buffer, with the tiles stacked vertically, so that a single
+    glReadPixels call produces the (N, H, W, 3) batch of observations.
+
+    With software OpenGL renderers such as llvmpipe, where rasterizing and
+    resolving the pixels dominate, the atlas brings no speedup. Passing
+    use_atlas=False renders and reads back each observation separately.
+
+    Environments are reset automatically when their episode ends.
+    """
+
+    def __init__(
+        self,
+        env_name,
+        num_envs,
+        obs_fb_profile=None,
+        use_atlas=True,
+        **kwargs
+    ):
+        assert num_envs >= 1
+
+        self.num_envs = num_envs
+
+        # Not all the environments take an obs_fb_profile argument,
+        # so it is only passed when set explicitly
+        if obs_fb_profile is not None:
+            kwargs['obs_fb_profile'] = obs_fb_profile
+        else:
+            obs_fb_profile = 'quality'
+
+        self.envs = []
+        for env_idx in range(num_envs):
+            env = gym.make(env_name, **kwargs).unwrapped
+            assert isinstance(env, MiniWorldEnv)
+            assert isinstance(env.observation_space, spaces.Box), \
+                "only image observations are supported"
+
+            # Observations are rendered by render_obs(), not by step()
+            env.defer_obs = True
+            self.envs.append(env)
+
+        self.observation_space = self.envs[0].observation_space
+        self.action_space = self.envs[0].action_space
+        self.obs_height, self.obs_width, _ = self.observation_space.shape
+
+        # Optional caller-provided array of shape (num_envs, obs_height,
+        # obs_width, 3) and dtype uint8, into which observations are read
+        self.obs_out = None
+
+        # Split the environments across as many atlas frame buffers
+        # as needed to stay within the maximum frame buffer size
+        self.use_atlas = use_atlas
+        self.atlases = []
+        if use_atlas:
+            max_tiles = max(1, get_max_fb_size() // self.obs_height)
+            fb_profile = get_fb_profile(obs_fb_profile)
+            for start in range(0, num_envs, max_tiles):
+                end = min(start + max_tiles, num_envs)
+                atlas = FrameBuffer(
+                    self.obs_width,
+                    (end - start) * self.obs_height,
+                    **fb_profile
+                )
+                self.atlases.append((start, end, atlas))
+
+    def seed(self, seed=None):
+        for env_idx, env in enumerate(self.envs):
+            env.seed(None if seed is None else seed + env_idx)
+
+    def reset(self):
+        """
+        Reset all the environments
+        Returns the batch of observations
+        """
+
+        for env in self.envs:
+            env.reset()
+
+        return self.render_obs(self.obs_out)
+
+    def step(self, actions):
+        """
+        Perform one action in each environment
+        Returns the batch of observations, and arrays of rewards and
+        done flags, as well as a list of info dicts
+        """
+
+        assert len(actions) == self.num_envs
+
+        rewards = np.zeros(shape=(self.num_envs,), dtype=np.float32)
+        dones = np.zeros(shape=(self.num_envs,), dtype=bool)
+        infos = []
+
+        for env_idx, env in enumerate(self.envs):
+            _, reward, done, info = env.step(actions[env_idx])
+
+            if done:
+                env.reset()
+
+            rewards[env_idx] = reward
+            dones[env_idx] = done
+            infos.append(info)
+
+        obs = self.render_obs(self.obs_out)
+
+        return obs, rewards, dones, infos
+
+    def render_obs(self, out=None):
+        """
+        Render the observations of all the environments
+        If an output array is given, the images are written directly into it
+        """
+
+        if out is None:
+            out = np.empty(
+                shape=(self.num_envs, self.obs_height, self.obs_width, 3),
+                dtype=np.uint8
+            )
+
+        assert out.shape[0] == self.num_envs
+        assert out.flags['C_CONTIGUOUS'], "output array must be contiguous"
+
+        # Without an atlas, read each observation back into its slot
+        if not self.use_atlas:
+            for env_idx, env in enumerate(self.envs):
+                env.render_obs(out=out[env_idx])
+
+        for start, end, atlas in self.atlases:
+            for env_idx in range(start, end):
+                self.envs[env_idx]._draw_obs(
+                    atlas,
+                    viewport=(
+                        0,
+                        (env_idx - start) * self.obs_height,
+                        self.obs_width,
+                        self.obs_height
+                    )
+                )
+
+            # The tiles are stacked vertically, so the images of
+            # consecutive environments are contiguous in memory
+            atlas.resolve(out[start:end].reshape(-1, self.obs_width, 3))
+
+        return out
+
+    def close(self):
+        for start, end, atlas in self.atlases:
+            atlas.delete()
+        self.atlases = []
+
+        for env in self.envs:
+            env.close()
@@ -1,4 +1,6 @@
 import math
+import weakref
+from collections import OrderedDict
 import numpy as np
 from .math import *
 from .opengl import *
@@ -18,6 +20,10 @@ COLORS = {
 COLOR_NAMES = sorted(list(COLORS.keys()))
 
 class Entity:
+    # Spatial hash of the EntityList this entity is in, if any,
+    # kept up to date when the position or radius is assigned
+    spatial_hash = None
+
     def __init__(self):
         # World position
         # Note: for most entities, the position is at floor level
@@ -44,6 +50,29 @@ class Entity:
         """
         raise NotImplementedError
 
+    @property
+    def batch_key(self):
+        """
+        Key shared by entities with identical geometry, which can be
+        drawn together by an EntityBatch. None if the entity can only
+        be drawn by calling its render method.
+        """
+        return None
+
+    def get_model_data(self):
+        """
+        Geometry of the object in model space, used by EntityBatch.
+        Returns a list of (texture, interleaved vertex array) chunks.
+        """
+        raise NotImplementedError
+
+    def get_instance(self):
+        """
+        Per-instance parameters used by EntityBatch: uniform scale
+        factor and color (None to keep the vertex colors)
+        """
+        return 1, None
+
     def step(self, delta_time):
         """
         Update the state of the object
@@ -69,6 +98,33 @@ class Entity:
 
         glEnd()
 
+    @property
+    def pos(self):
+        return self._pos
+
+    @pos.setter
+    def pos(self, pos):
+        # Positions must be assigned rather than modified in place for
+        # the spatial hash to see the change, except for the Y coordinate
+        self._pos = pos
+        self._update_hash()
+
+    @property
+    def radius(self):
+        return self._radius
+
+    @radius.setter
+    def radius(self, radius):
+        self._radius = radius
+        self._update_hash()
+
+    def _update_hash(self):
+        if self.spatial_hash is not None:
+            if self.pos is None:
+                self.spatial_hash.remove(self)
+            else:
+                self.spatial_hash.insert(self, self.pos, self.radius)
+
     @property
     def dir_vec(self):
         """
@@ -141,6 +197,16 @@ class MeshEnt(Entity):
         self.mesh.render()
         glPopMatrix()
 
+    @property
+    def batch_key(self):
+        return self.mesh
+
+    def get_model_data(self):
+        return list(zip(self.mesh.textures, self.mesh.chunk_data))
+
+    def get_instance(self):
+        return self.scale, None
+
     @property
     def is_static(self):
         return self.static
@@ -186,8 +252,9 @@ class ImageFrame(Entity):
         glRotatef(self.dir * (180/math.pi), 0, 1, 0)
 
         # Bind texture for front
+        state = get_gl_state()
         glColor3f(1, 1, 1)
-        glEnable(GL_TEXTURE_2D)
+        state.enable(GL_TEXTURE_2D)
         self.tex.bind()
 
         # Front face, showing image
@@ -204,7 +271,7 @@ class ImageFrame(Entity):
         glEnd()
 
         # Black frame/border
-        glDisable(GL_TEXTURE_2D)
+        state.disable(GL_TEXTURE_2D)
         glColor3f(0, 0, 0)
 
         glBegin(GL_QUADS)
@@ -247,6 +314,16 @@ class TextFrame(Entity):
     Note: the position is in the middle of the frame, on the wall
     """
 
+    # Cache of baked text textures, by glyph paths, in least recently
+    # used order. Its size is bounded since randomized glyphs make
+    # many different combinations.
+    text_cache = OrderedDict()
+    text_cache_size = 64
+
+    # Number of TextFrames using each baked text texture. Textures
+    # evicted from the cache are deleted once none of them uses them.
+    text_refs = {}
+
     def __init__(self, pos, dir, str, height=0.15, depth=0.05):
         super().__init__()
 
@@ -255,6 +332,9 @@ class TextFrame(Entity):
 
         self.str = str
 
+        self.tex = None
+        self.tex_release = None
+
         self.depth = depth
         self.height = height
         self.width = len(str) * height
@@ -264,16 +344,88 @@ class TextFrame(Entity):
         return True
 
     def randomize(self, params, rng):
-        self.texs = []
+        glyph_paths = []
         for ch in self.str:
+            if ch == ' ':
+                glyph_paths.append(None)
+                continue
+
+            # The character textures are named after their code point
+            tex_name = f'chars/ch_0x{ord(ch)}'
             try:
-                if ch == ' ':
-                    self.texs.append(None)
-                else:
-                    tex_name = f'chars/ch_0x{ord(ch)}'
-                    self.texs.append(Texture.get(tex_name, rng))
-            except:
-                raise 'only alphanumerical characters supported in TextFrame'
+                glyph_paths.append(Texture.get_path(tex_name, rng))
+            except AssertionError:
+                raise ValueError(
+                    'only alphanumerical characters supported in TextFrame'
+                )
+
+        tex = self._bake_text(glyph_paths)
+
+        # Release the previous texture after acquiring the new one,
+        # in case they are the same
+        release = self.tex_release
+        self.tex = tex
+        self.tex_release = None
+        if tex is not None:
+            self.text_refs[tex] = self.text_refs.get(tex, 0) + 1
+            self.tex_release = weakref.finalize(self, TextFrame._release_text, tex)
+            self.tex_release.atexit = False
+        if release is not None:
+            release()
+
+    @classmethod
+    def _release_text(cls, tex):
+        """
+        Stop using a baked text texture, deleting it if it was
+        evicted from the cache and no other TextFrame uses it
+        """
+
+        cls.text_refs[tex] -= 1
+        if cls.text_refs[tex] == 0:
+            del cls.text_refs[tex]
+            if tex not in cls.text_cache.values():
+                tex.delete()
+
+    @classmethod
+    def _bake_text(cls, glyph_paths):
+        """
+        Lay out the glyph images of a string side by side in one texture,
+        so that the text is drawn with a single quad. Spaces are white,
+        which is how untextured quads appear.
+        """
+
+        key = tuple(glyph_paths)
+        if key in cls.text_cache:
+            cls.text_cache.move_to_end(key)
+            return cls.text_cache[key]
+
+        glyphs = [load_mipmaps(path) for path in glyph_paths if path]
+        if len(glyphs) == 0:
+            tex = None
+
+        else:
+            assert all(g[0].shape == glyphs[0][0].shape for g in glyphs)
+
+            # Glyph widths are even down to the 1 texel level, so the
+            # mipmaps of the text are the glyph mipmaps side by side
+            levels = []
+            for level in range(len(glyphs[0])):
+                glyph_levels = iter(g[level] for g in glyphs)
+                space = np.full_like(glyphs[0][level], 255)
+                levels.append(np.concatenate(
+                    [next(glyph_levels) if p else space for p in glyph_paths],
+                    axis=1
+                ))
+            levels += gen_mipmaps(levels[-1])[1:]
+            tex = Texture(Texture.upload(levels), 'text')
+
+        cls.text_cache[key] = tex
+        if len(cls.text_cache) > cls.text_cache_size:
+            _, old_tex = cls.text_cache.popitem(last=False)
+            if old_tex is not None and old_tex not in cls.text_refs:
+                old_tex.delete()
+
+        return tex
 
     def render(self):
         """
@@ -293,36 +445,30 @@ class TextFrame(Entity):
         glRotatef(self.dir * (180/math.pi), 0, 1, 0)
 
         # Bind texture for front
+        state = get_gl_state()
         glColor3f(1, 1, 1)
-
-        # For each character
-        for idx, ch in enumerate(self.str):
-            tex = self.texs[idx]
-            if tex:
-                glEnable(GL_TEXTURE_2D)
-                self.texs[idx].bind()
-            else:
-                glDisable(GL_TEXTURE_2D)
-
-            char_width = self.height
-            z_0 = hz - char_width * (idx+1)
-            z_1 = z_0 + char_width
-
-            # Front face, showing image
-            glBegin(GL_QUADS)
-            glNormal3f(1, 0, 0)
-            glTexCoord2f(1, 1)
-            glVertex3f(sx, +hy, z_0)
-            glTexCoord2f(0, 1)
-            glVertex3f(sx, +hy, z_1)
-            glTexCoord2f(0, 0)
-            glVertex3f(sx, -hy, z_1)
-            glTexCoord2f(1, 0)
-            glVertex3f(sx, -hy, z_0)
-            glEnd()
+        if self.tex:
+            state.enable(GL_TEXTURE_2D)
+            self.tex.bind()
+        else:
+            state.disable(GL_TEXTURE_2D)
+
+        # Front face, showing the text, with the first
+        # character at the +z end of the frame
+        glBegin(GL_QUADS)
+        glNormal3f(1, 0, 0)
+        glTexCoord2f(1, 1)
+        glVertex3f(sx, +hy, -hz)
+        glTexCoord2f(0, 1)
+        glVertex3f(sx, +hy, +hz)
+        glTexCoord2f(0, 0)
+        glVertex3f(sx, -hy, +hz)
+        glTexCoord2f(1, 0)
+        glVertex3f(sx, -hy, -hz)
+        glEnd()
 
         # Black frame/border
-        glDisable(GL_TEXTURE_2D)
+        state.disable(GL_TEXTURE_2D)
         glColor3f(0, 0, 0)
 
         glBegin(GL_QUADS)
@@ -387,16 +533,19 @@ class Box(Entity):
         Draw the object
         """
 
-        sx, sy, sz = self.size
-
-        glDisable(GL_TEXTURE_2D)
+        get_gl_state().disable(GL_TEXTURE_2D)
         glColor3f(*self.color_vec)
 
         glPushMatrix()
         glTranslatef(*self.pos)
         glRotatef(self.dir * (180/math.pi), 0, 1, 0)
+        drawBox(**self._box_extents())
+        glPopMatrix()
 
-        drawBox(
+    def _box_extents(self):
+        sx, sy, sz = self.size
+
+        return dict(
             x_min=-sx/2,
             x_max=+sx/2,
             y_min=0,
@@ -408,7 +557,15 @@ class Box(Entity):
             z_max=+sz/2
         )
 
-        glPopMatrix()
+    @property
+    def batch_key(self):
+        return (Box, tuple(self.size))
+
+    def get_model_data(self):
+        return [(None, gen_box_data(**self._box_extents()))]
+
+    def get_instance(self):
+        return 1, self.color_vec
 
 
 class RectangularBox(Entity):
@@ -441,7 +598,7 @@ class RectangularBox(Entity):
 
         sx, sy, sz = self.size
 
-        glDisable(GL_TEXTURE_2D)
+        get_gl_state().disable(GL_TEXTURE_2D)
         glColor3f(*self.color_vec)
 
         glPushMatrix()
@@ -583,3 +740,234 @@ class Agent(Entity):
 
     def step(self, delta_time):
         pass
+
+class EntityBatch:
+    """
+    Draws a group of entities sharing the same batch_key with one draw
+    call per texture. The fixed-function pipeline has no instancing,
+    so the per-instance transforms are applied with numpy, and the
+    vertex buffer is only updated when an entity has moved.
+    """
+
+    def __init__(self, ent):
+        # Model-space geometry shared by all instances
+        self.chunks = ent.get_model_data()
+
+        self.vbuf = VertexBuffer(usage=GL_DYNAMIC_DRAW)
+
+        # Instance parameters the vertex buffer was last built from
+        self.inst_params = None
+
+        # Texture and vertex range for each chunk in the vertex buffer
+        self.ranges = []
+
+    def _update(self, ents):
+        """
+        Transform the geometry for each instance and upload it
+        """
+
+        params = np.zeros(shape=(len(ents), 8), dtype=np.float32)
+        recolor = False
+        for idx, ent in enumerate(ents):
+            scale, color = ent.get_instance()
+            params[idx, 0:3] = ent.pos
+            params[idx, 3] = ent.dir
+            params[idx, 4] = scale
+            if color is not None:
+                params[idx, 5:8] = color
+                recolor = True
+
+        if self.inst_params is not None and np.array_equal(params, self.inst_params):
+            return
+        self.inst_params = params
+
+        pos = params[:, None, 0:3]
+        cos = np.cos(params[:, None, 3])
+        sin = np.sin(params[:, None, 3])
+        scale = params[:, None, 4]
+
+        all_data = []
+        self.ranges = []
+        first = 0
+
+        for tex, data in self.chunks:
+            # Same transform as glTranslatef, glScalef and glRotatef
+            # around the Y axis. Normals are scaled by 1/scale, like
+            # the fixed-function pipeline does when GL_NORMALIZE is off.
+            out = np.empty(shape=(len(ents),) + data.shape, dtype=np.float32)
+            out[:] = data
+            x, y, z = data[:, 0], data[:, 1], data[:, 2]
+            out[:, :, 0] = scale * (cos * x + sin * z)
+            out[:, :, 1] = scale * y
+            out[:, :, 2] = scale * (cos * z - sin * x)
+            out[:, :, 0:3] += pos
+            nx, nz = data[:, 3], data[:, 5]
+            out[:, :, 3] = (cos * nx + sin * nz) / scale
+            out[:, :, 4] = data[:, 4] / scale
+            out[:, :, 5] = (cos * nz - sin * nx) / scale
+            if recolor:
+                out[:, :, 8:11] = params[:, None, 5:8]
+
+            out = out.reshape(-1, data.shape[1])
+            all_data.append(out)
+            self.ranges.append((tex, first, out.shape[0]))
+            first += out.shape[0]
+
+        self.vbuf.upload(np.concatenate(all_data))
+
+    def get_draws(self, ents):
+        """
+        Get the (vertex buffer, texture, first, count) ranges to draw
+        for all the entities in the batch (see draw_ranges)
+        """
+
+        self._update(ents)
+
+        return [(self.vbuf, tex, first, count) for tex, first, count in self.ranges]
+
+    def render(self, ents):
+        """
+        Draw all the entities in the batch
+        """
+
+        draw_ranges(self.get_draws(ents))
+
+    def delete(self):
+        self.vbuf.delete()
+
+class EntityList(list):
+    """
+    List of the entities of an environment, which keeps a spatial hash
+    of their positions up to date as entities are added and removed and
+    as they move, so that intersection and proximity queries don't need
+    to go through all the entities
+    """
+
+    def __init__(self, ents=()):
+        super().__init__()
+        self.hash = SpatialHash()
+        self.extend(ents)
+
+    def _add(self, ent):
+        ent.spatial_hash = self.hash
+        ent._update_hash()
+
+    def _discard(self, ent):
+        # The same entity may be listed more than once
+        if ent not in self:
+            self.hash.remove(ent)
+            ent.spatial_hash = None
+
+    def append(self, ent):
+        super().append(ent)
+        self._add(ent)
+
+    def insert(self, idx, ent):
+        super().insert(idx, ent)
+        self._add(ent)
+
+    def extend(self, ents):
+        ents = list(ents)
+        super().extend(ents)
+        for ent in ents:
+            self._add(ent)
+
+    def __iadd__(self, ents):
+        self.extend(ents)
+        return self
+
+    def remove(self, ent):
+        super().remove(ent)
+        self._discard(ent)
+
+    def pop(self, idx=-1):
+        ent = super().pop(idx)
+        self._discard(ent)
+        return ent
+
+    def clear(self):
+        for ent in self:
+            ent.spatial_hash = None
+        super().clear()
+        self.hash.clear()
+
+    def __setitem__(self, idx, value):
+        removed = self[idx]
+        super().__setitem__(idx, value)
+        for ent in (removed if isinstance(idx, slice) else [removed]):
+            self._discard(ent)
+        for ent in (self[idx] if isinstance(idx, slice) else [value]):
+            self._add(ent)
+
+    def __delitem__(self, idx):
+        removed = self[idx]
+        super().__delitem__(idx)
+        for ent in (removed if isinstance(idx, slice) else [removed]):
+            self._discard(ent)
+
+    def intersect(self, pos, radius, exclude=None):
+        """
+        Find the first entity, in list order, whose bounding circle
+        intersects a circle of a given radius, or None
+        """
+
+        ents = [ent for ent in self.hash.intersect(pos, radius) if ent is not exclude]
+
+        if len(ents) == 0:
+            return None
+        if len(ents) == 1:
+            return ents[0]
+
+        return min(ents, key=self.index)
+
+    def intersect_swept(self, p0, p1, radius, exclude=()):
+        """
+        Find the first entity, in list order and not in exclude, whose
+        bounding circle intersects a circle of a given radius moving in
+        a straight line from p0 to p1. Entities which already intersect
+        the circle at p0 are only counted if they still intersect it at p1.
+        """
+
+        x0, _, z0 = p0
+        x1, _, z1 = p1
+        dx = x1 - x0
+        dz = z1 - z0
+        len2 = dx * dx + dz * dz
+
+        # Search around the middle of the path
+        mid = ((x0 + x1) / 2, 0, (z0 + z1) / 2)
+        ents = self.hash.intersect(mid, radius + math.sqrt(len2) / 2)
+
+        hits = []
+        for ent in ents:
+            if ent in exclude:
+                continue
+
+            _, x, z, ent_radius = self.hash.entries[ent]
+            min_dist = radius + ent_radius
+
+            # Distances to the end points, and to the closest point of the path
+            dist_start = math.sqrt((x - x0) ** 2 + (z - z0) ** 2)
+            dist_end = math.sqrt((x - x1) ** 2 + (z - z1) ** 2)
+            t = min(max(((x - x0) * dx + (z - z0) * dz) / len2, 0), 1) if len2 > 0 else 0
+            dist_path = math.sqrt((x - x0 - t * dx) ** 2 + (z - z0 - t * dz) ** 2)
+
+            if dist_end < min_dist or (dist_path < min_dist and dist_start >= min_dist):
+                hits.append(ent)
+
+        if len(hits) == 0:
+            return None
+
+        return min(hits, key=self.index)
+
+    def within(self, pos, radius):
+        """
+        Get the entities whose bounding circle intersects a circle
+        of a given radius, in list order
+        """
+
+        ents = self.hash.intersect(pos, radius)
+        if len(ents) <= 1:
+            return ents
+
+        return sorted(ents, key=self.index)
@@ -49,6 +49,9 @@ class OneRoomNoTask(MiniWorldEnv):
     placed randomly in one big room.
     """
 
+    # Move forward twice as far with each move_forward action
+    forward_repeat = 2
+
     def __init__(self, size=10, max_episode_steps=180, simple_env=False, place_box=False, randomize_start_pos=True, box_size=0.8, **kwargs):
         assert size % 2 == 0
 
@@ -128,14 +131,6 @@ class OneRoomNoTask(MiniWorldEnv):
             dir=random_dir, pos=random_start_pos
         )
 
-    def step(self, action):
-        obs, reward, done, info = super().step(action)
-
-        if action == 2:  # if move forward, then move forward twice
-            obs, reward, done, info = super().step(action)
-
-        return obs, reward, done, info
-
 class OneRoomS6(OneRoom):
     def __init__(self, max_episode_steps=100, **kwargs):
         super().__init__(size=6, max_episode_steps=max_episode_steps, **kwargs)
@@ -173,6 +168,9 @@ class AsymmetricOneRoomNoTask(MiniWorldEnv):
     placed randomly in one big room.
     """
 
+    # Move forward twice as far with each move_forward action
+    forward_repeat = 2
+
     def __init__(self, size=8, max_episode_steps=180, simple_env=False, place_box=False, randomize_start_pos=True, box_size=0.8, **kwargs):
         assert size % 2 == 0
 
@@ -250,14 +248,6 @@ class AsymmetricOneRoomNoTask(MiniWorldEnv):
             dir=random_dir, pos=random_start_pos
         )
 
-    def step(self, action):
-        obs, reward, done, info = super().step(action)
-
-        if action == 2:  # if move forward, then move forward twice
-            obs, reward, done, info = super().step(action)
-
-        return obs, reward, done, info
-
 class AsymmetricOneRoomS6NoTask(AsymmetricOneRoomNoTask):
     def __init__(self, turn_step=30, forward_step=0.5, env_kwargs=None):
         # Parameters for larger movement steps, fast stepping
@@ -291,6 +281,9 @@ class OneRectangularRoomNoTask(MiniWorldEnv):
     placed randomly in one big room.
     """
 
+    # Move forward twice as far with each move_forward action
+    forward_repeat = 2
+
     def __init__(self, size_x=10, size_y=10, max_episode_steps=180, simple_env=False, place_box=False, randomize_start_pos=True, box_size=0.8, **kwargs):
         assert size_x % 2 == 0
         assert size_y % 2 == 0
@@ -350,14 +343,6 @@ class OneRectangularRoomNoTask(MiniWorldEnv):
             dir=random_dir, pos=random_start_pos
         )
 
-    def step(self, action):
-        obs, reward, done, info = super().step(action)
-
-        if action == 2:  # if move forward, then move forward twice
-            obs, reward, done, info = super().step(action)
-
-        return obs, reward, done, info
-
 class OneRectangularRoomS6NoTask(OneRectangularRoomNoTask):
     def __init__(self, turn_step=30, forward_step=0.5, env_kwargs=None):
         # Parameters for larger movement steps, fast stepping
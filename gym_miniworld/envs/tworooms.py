@@ -54,6 +54,9 @@ class TwoRoomsS6NoTask(MiniWorldEnv):
     The agent must reach the red box to get a reward.
     """
 
+    # Move forward twice as far with each move_forward action
+    forward_repeat = 2
+
     def __init__(self, forward_step=0.5, turn_step=30, env_kwargs=None):
         # Parameters for larger movement steps, fast stepping
         params = DEFAULT_PARAMS.no_random()
@@ -138,11 +141,3 @@ class TwoRoomsS6NoTask(MiniWorldEnv):
         self.place_agent(
             dir=start_dir, pos=start_pos
         )
-
-    def step(self, action):
-        obs, reward, done, info = super().step(action)
-
-        if action == 2:  # if move forward, then move forward twice
-            obs, reward, done, info = super().step(action)
-
-        return obs, reward, done, info
@@ -10,6 +10,9 @@ class TwoRoomSmall(MiniWorldEnv):
     Outside environment with two rooms connected by a gap in a wall
     """
 
+    # Move forward twice as far with each move_forward action
+    forward_repeat = 2
+
     def __init__(self, env_kwargs=None):
         # Parameters for larger movement steps, fast stepping
         params = DEFAULT_PARAMS.no_random()
@@ -118,8 +121,6 @@ class TwoRoomSmall(MiniWorldEnv):
 
     def step(self, action):
         obs, reward, done, info = super().step(action)
-        if action == 2:
-            obs, reward, done, info = super().step(action)
 
         # if self.near(self.box):
         #     reward += self._reward()
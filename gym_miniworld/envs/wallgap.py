@@ -10,6 +10,9 @@ class WallGap(MiniWorldEnv):
     Outside environment with two rooms connected by a gap in a wall
     """
 
+    # Move forward three times as far with each move_forward action
+    forward_repeat = 3
+
     def __init__(self, **kwargs):
         # Parameters for larger movement steps, fast stepping
         params = DEFAULT_PARAMS.no_random()
@@ -62,9 +65,6 @@ class WallGap(MiniWorldEnv):
 
     def step(self, action):
         obs, reward, done, info = super().step(action)
-        if action == 2:
-            obs, reward, done, info = super().step(action)
-            obs, reward, done, info = super().step(action)
 
         if self.near(self.box):
             reward += self._reward()
@@ -55,3 +55,461 @@ def intersect_circle_segs(point, radius, segs):
 
     # No intersection
     return None
+
+def intersect_circles_segs(points, radius, segs):
+    """
+    Test which of a set of circles of the same radius, with centers given
+    as an (N, 3) array, intersect with any wall segments. Vectorized form
+    of intersect_circle_segs, returning a boolean array of shape (N,).
+    """
+
+    if len(segs) == 0:
+        return np.zeros(len(points), dtype=bool)
+
+    # Ignore Y coordinate
+    points = points[:, ::2]
+    a = segs[:, 0, ::2]
+    ab = segs[:, 1, ::2] - a
+
+    # Shape is (num points, num segments, 2)
+    ap = points[:, None, :] - a
+
+    proj_dist = (ap * ab).sum(axis=2) / (ab * ab).sum(axis=1)
+    proj_dist = proj_dist.clip(0, 1)
+
+    # Vectors from the test points to the closest points on the segments
+    pc = proj_dist[:, :, None] * ab - ap
+
+    return ((pc * pc).sum(axis=2) < radius * radius).any(axis=1)
+
+def dist_point_segs(points, a, b):
+    """
+    Distances from points to segments from a to b on the XZ plane,
+    with the (..., 2) arrays of coordinates broadcast against each other
+    """
+
+    ab = b - a
+    ap = points - a
+
+    proj_dist = (ap * ab).sum(axis=-1) / np.maximum((ab * ab).sum(axis=-1), 1e-12)
+    proj_dist = proj_dist.clip(0, 1)
+
+    # Vectors from the points to the closest points on the segments
+    pc = proj_dist[..., None] * ab - ap
+
+    return np.sqrt((pc * pc).sum(axis=-1))
+
+def intersect_swept_circle_segs(p0, p1, radius, segs):
+    """
+    Test if a circle moving in a straight line from p0 to p1 intersects
+    with any wall segments along the way. Segments which already intersect
+    the circle at p0 are only counted if they still intersect it at p1,
+    so that objects overlapping a wall can move away from it.
+    """
+
+    if intersect_circle_segs(p1, radius, segs):
+        return True
+
+    # Ignore Y coordinate
+    p0 = np.array([p0[0], p0[2]])
+    p1 = np.array([p1[0], p1[2]])
+    a = segs[:, 0, ::2]
+    b = segs[:, 1, ::2]
+
+    dist_start = dist_point_segs(p0, a, b)
+
+    # Distances between the path and the segments
+    dist_path = np.minimum.reduce([
+        dist_start,
+        dist_point_segs(p1, a, b),
+        dist_point_segs(a, p0, p1),
+        dist_point_segs(b, p0, p1)
+    ])
+
+    # The distance is zero where the path crosses a segment, that is where
+    # the ends of each one are on opposite sides of the other
+    def cross(u, v):
+        return u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]
+    ab = b - a
+    d = p1 - p0
+    crosses = (
+        (cross(ab, p0 - a) * cross(ab, p1 - a) < 0) &
+        (cross(d, a - p0) * cross(d, b - p0) < 0)
+    )
+    dist_path[crosses] = 0
+
+    if np.any((dist_path < radius) & (dist_start >= radius)):
+        return True
+
+    # No intersection
+    return None
+
+class SegmentGrid:
+    """
+    Uniform grid over the XZ plane indexing a set of (N, 2, 3) segments,
+    so that a circle only needs to be tested against the segments in the
+    cells it overlaps, whatever the total number of segments.
+    Each segment is listed in all the cells its bounding box overlaps.
+    """
+
+    def __init__(self, segs, cell_size=1.0):
+        segs = np.asarray(segs, dtype=float).reshape(-1, 2, 3)
+
+        self.segs = segs
+        self.cell_size = cell_size
+
+        if len(segs) == 0:
+            self.min_x = self.min_z = 0
+            self.num_x = self.num_z = 0
+            self.cell_segs = segs
+            self.cell_starts = np.zeros(1, dtype=int)
+            return
+
+        xs = segs[:, :, 0]
+        zs = segs[:, :, 2]
+        self.min_x = xs.min()
+        self.min_z = zs.min()
+
+        # Range of cells covered by the bounding box of each segment
+        x0 = self._cells(xs.min(axis=1), self.min_x)
+        x1 = self._cells(xs.max(axis=1), self.min_x)
+        z0 = self._cells(zs.min(axis=1), self.min_z)
+        z1 = self._cells(zs.max(axis=1), self.min_z)
+        self.num_x = int(x1.max()) + 1
+        self.num_z = int(z1.max()) + 1
+
+        # List the (cell, segment) pairs, cells being numbered row by row
+        span_x = x1 - x0 + 1
+        num_cells = span_x * (z1 - z0 + 1)
+        seg_ids = np.repeat(np.arange(len(segs)), num_cells)
+        offsets = np.arange(len(seg_ids)) - np.repeat(np.cumsum(num_cells) - num_cells, num_cells)
+        cx = x0[seg_ids] + offsets % span_x[seg_ids]
+        cz = z0[seg_ids] + offsets // span_x[seg_ids]
+        cell_ids = cz * self.num_x + cx
+
+        # Copies of the segments sorted by cell, with the segments of cell
+        # i at cell_starts[i]:cell_starts[i+1], so that the cells of a row
+        # of the grid form a contiguous range
+        order = np.argsort(cell_ids, kind='stable')
+        self.cell_segs = segs[seg_ids[order]]
+        self.cell_starts = np.searchsorted(
+            cell_ids[order],
+            np.arange(self.num_x * self.num_z + 1)
+        )
+
+    def _cells(self, coords, min_coord):
+        return np.floor((coords - min_coord) / self.cell_size).astype(int)
+
+    def query(self, point, radius):
+        """
+        Get the segments that may be within a given distance of a point,
+        as an (M, 2, 3) array. Segments may be listed more than once.
+        """
+
+        px, _, pz = point
+        cs = self.cell_size
+
+        x0 = max(math.floor((px - radius - self.min_x) / cs), 0)
+        x1 = min(math.floor((px + radius - self.min_x) / cs), self.num_x - 1)
+        z0 = max(math.floor((pz - radius - self.min_z) / cs), 0)
+        z1 = min(math.floor((pz + radius - self.min_z) / cs), self.num_z - 1)
+
+        if x0 > x1 or z0 > z1:
+            return self.cell_segs[0:0]
+
+        starts = self.cell_starts
+        rows = [
+            self.cell_segs[starts[z * self.num_x + x0]:starts[z * self.num_x + x1 + 1]]
+            for z in range(z0, z1 + 1)
+        ]
+
+        if len(rows) == 1:
+            return rows[0]
+        return np.concatenate(rows)
+
+    def intersect_circle(self, point, radius):
+        """
+        Test if a circle intersects with any of the segments
+        See intersect_circle_segs
+        """
+
+        segs = self.query(point, radius)
+        if len(segs) == 0:
+            return None
+
+        return intersect_circle_segs(point, radius, segs)
+
+    def intersect_swept_circle(self, p0, p1, radius):
+        """
+        Test if a circle moving from p0 to p1 intersects with any
+        of the segments along the way
+        See intersect_swept_circle_segs
+        """
+
+        # Search around the middle of the path
+        half_len = np.linalg.norm(np.subtract(p1, p0)[::2]) / 2
+        segs = self.query(np.add(p0, p1) / 2, radius + half_len)
+        if len(segs) == 0:
+            return None
+
+        return intersect_swept_circle_segs(p0, p1, radius, segs)
+
+class OccupancyGrid:
+    """
+    Rasterization of a floorplan into a uniform grid over the XZ plane.
+    For each cell, the grid stores the index of the room containing the
+    center of the cell (-1 if none), and the distance from the center of
+    the cell to the nearest wall segment, up to max_dist. Circle tests in
+    cells far enough from the walls, or close enough to them, are decided
+    from the cell alone, and the others are tested against the segments.
+    """
+
+    def __init__(
+        self,
+        wall_grid,
+        room_boxes,
+        room_outlines,
+        room_edge_norms,
+        cell_size=0.1,
+        max_dist=1.0
+    ):
+        self.wall_grid = wall_grid
+        self.cell_size = cell_size
+        self.max_dist = max_dist
+
+        # Distance from the center of a cell to its corners, rounded up
+        self.cell_radius = cell_size * math.sqrt(0.5) * (1 + 1e-6)
+
+        self.min_x = room_boxes[:, 0].min()
+        self.min_z = room_boxes[:, 2].min()
+        self.num_x = max(int(math.ceil((room_boxes[:, 1].max() - self.min_x) / cell_size)), 1)
+        self.num_z = max(int(math.ceil((room_boxes[:, 3].max() - self.min_z) / cell_size)), 1)
+
+        # Coordinates of the cell centers
+        self.xs = self.min_x + (np.arange(self.num_x) + 0.5) * cell_size
+        self.zs = self.min_z + (np.arange(self.num_z) + 0.5) * cell_size
+
+        # Room containing the center of each cell
+        self.room_ids = np.full((self.num_z, self.num_x), -1, dtype=int)
+        for room_idx, (x0, x1, z0, z1) in enumerate(room_boxes):
+            xr = self._cells(x0, x1, self.min_x, self.num_x)
+            zr = self._cells(z0, z1, self.min_z, self.num_z)
+            ax, _, az = room_outlines[room_idx].T
+            nx, _, nz = room_edge_norms[room_idx].T
+
+            # Shape is (rows, columns, num walls)
+            px = self.xs[None, xr, None] - ax
+            pz = self.zs[zr, None, None] - az
+            inside = (nx * px + nz * pz > 0).all(axis=2)
+            self.room_ids[zr, xr][inside] = room_idx
+
+        # Distance from each cell center to the nearest wall segment,
+        # only computed for the cells within max_dist of each segment
+        self.clearance = np.full((self.num_z, self.num_x), float(max_dist))
+        for (ax, _, az), (bx, _, bz) in wall_grid.segs:
+            xr = self._cells(min(ax, bx) - max_dist, max(ax, bx) + max_dist, self.min_x, self.num_x)
+            zr = self._cells(min(az, bz) - max_dist, max(az, bz) + max_dist, self.min_z, self.num_z)
+            px = self.xs[None, xr] - ax
+            pz = self.zs[zr, None] - az
+
+            abx, abz = bx - ax, bz - az
+            proj_dist = (px * abx + pz * abz) / ((abx * abx + abz * abz) or 1)
+            proj_dist = proj_dist.clip(0, 1)
+            dist = np.hypot(proj_dist * abx - px, proj_dist * abz - pz)
+
+            patch = self.clearance[zr, xr]
+            np.minimum(patch, dist, out=patch)
+
+    def _cells(self, lo, hi, min_coord, num):
+        """
+        Slice of the cells along one axis whose centers may lie
+        within the range [lo, hi]
+        """
+
+        c0 = max(int(math.floor((lo - min_coord) / self.cell_size)), 0)
+        c1 = min(int(math.floor((hi - min_coord) / self.cell_size)) + 1, num)
+        return slice(c0, max(c0, c1))
+
+    def get_cell(self, point):
+        """
+        Get the (x, z) indices of the cell containing a point,
+        or None if the point is outside of the grid
+        """
+
+        px, _, pz = point
+        cx = int(math.floor((px - self.min_x) / self.cell_size))
+        cz = int(math.floor((pz - self.min_z) / self.cell_size))
+
+        if 0 <= cx < self.num_x and 0 <= cz < self.num_z:
+            return cx, cz
+        return None
+
+    def get_free_space(self, radius):
+        """
+        Get a (num_z, num_x) boolean array of the cells whose center is
+        inside a room, at a distance of at least radius from the walls.
+        The radius must be less than max_dist.
+        """
+
+        return (self.room_ids >= 0) & (self.clearance >= radius)
+
+    def intersect_circle(self, point, radius):
+        """
+        Test if a circle intersects with any of the wall segments
+        See SegmentGrid.intersect_circle
+        """
+
+        cell = self.get_cell(point)
+
+        if cell is not None:
+            clearance = self.clearance[cell[1], cell[0]]
+
+            # The circle clears the walls from anywhere in the cell
+            if clearance - self.cell_radius > radius:
+                return None
+
+            # The circle overlaps the walls from anywhere in the cell
+            if clearance < self.max_dist and clearance + self.cell_radius < radius:
+                return True
+
+        return self.wall_grid.intersect_circle(point, radius)
+
+    def intersect_swept_circle(self, p0, p1, radius):
+        """
+        Test if a circle moving from p0 to p1 intersects with any
+        of the wall segments along the way
+        See SegmentGrid.intersect_swept_circle
+        """
+
+        # The whole path is within half its length of its middle
+        half_len = np.linalg.norm(np.subtract(p1, p0)[::2]) / 2
+        cell = self.get_cell(np.add(p0, p1) / 2)
+
+        if cell is not None:
+            clearance = self.clearance[cell[1], cell[0]]
+            if clearance - self.cell_radius > radius + half_len:
+                return None
+
+        return self.wall_grid.intersect_swept_circle(p0, p1, radius)
+
+    def get_place_cells(self, radius, room_idx=None):
+        """
+        Get the flat indices of the cells which may contain positions
+        where a circle clears the walls, within a given room or any room
+        """
+
+        if room_idx is None:
+            mask = self.room_ids >= 0
+        else:
+            mask = self.room_ids == room_idx
+
+        if radius < self.max_dist:
+            mask &= self.clearance + self.cell_radius >= radius
+
+        return np.flatnonzero(mask)
+
+    def sample(self, rand, cells, num):
+        """
+        Draw random points in cells picked at random among the given ones,
+        and return them along with the rooms containing the cell centers
+        """
+
+        cells = cells[rand.choice_idxs(len(cells), num)]
+        cz, cx = np.divmod(cells, self.num_x)
+
+        points = np.zeros((num, 3))
+        points[:, 0] = self.xs[cx] + rand.float(-0.5, 0.5, num) * self.cell_size
+        points[:, 2] = self.zs[cz] + rand.float(-0.5, 0.5, num) * self.cell_size
+
+        return points, self.room_ids.flat[cells]
+
+class SpatialHash:
+    """
+    Spatial hash of circles on the XZ plane, used to find the objects
+    near a point without testing all of them. Objects are hashed by the
+    cell containing their center, and queries widen their search by the
+    radius of the largest object inserted.
+    """
+
+    def __init__(self, cell_size=1.0):
+        self.cell_size = cell_size
+
+        # Objects in each cell, as dicts used as ordered sets
+        self.cells = {}
+
+        # Cell, X and Z coordinates and radius of each object
+        self.entries = {}
+
+        # Largest radius inserted, never decreased
+        self.max_radius = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _cell(self, x, z):
+        return (math.floor(x / self.cell_size), math.floor(z / self.cell_size))
+
+    def insert(self, obj, pos, radius):
+        """
+        Insert an object, or update its position and radius
+        """
+
+        self.remove(obj)
+
+        x, _, z = pos
+        cell = self._cell(x, z)
+        self.cells.setdefault(cell, {})[obj] = None
+        self.entries[obj] = (cell, x, z, radius)
+        self.max_radius = max(self.max_radius, radius)
+
+    def remove(self, obj):
+        entry = self.entries.pop(obj, None)
+        if entry is None:
+            return
+
+        cell = entry[0]
+        del self.cells[cell][obj]
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def clear(self):
+        self.cells.clear()
+        self.entries.clear()
+        self.max_radius = 0
+
+    def intersect(self, pos, radius):
+        """
+        Find the objects whose circle intersects the circle of a given
+        radius around a point, that is whose center is closer than
+        the sum of the radii. The order of the objects is undefined.
+        """
+
+        px, _, pz = pos
+        reach = radius + self.max_radius
+        x0, z0 = self._cell(px - reach, pz - reach)
+        x1, z1 = self._cell(px + reach, pz + reach)
+
+        # Scan the cells overlapped by the search area, unless there
+        # are fewer occupied cells than that, in which case scan those
+        if (x1 - x0 + 1) * (z1 - z0 + 1) <= len(self.cells):
+            cells = (
+                self.cells.get((cx, cz), ())
+                for cx in range(x0, x1 + 1)
+                for cz in range(z0, z1 + 1)
+            )
+        else:
+            cells = (
+                objs for (cx, cz), objs in self.cells.items()
+                if x0 <= cx <= x1 and z0 <= cz <= z1
+            )
+
+        found = []
+        for objs in cells:
+            for obj in objs:
+                _, x, z, obj_radius = self.entries[obj]
+                dx = x - px
+                dz = z - pz
+                if math.sqrt(dx * dx + dz * dz) < radius + obj_radius:
+                    found.append(obj)
+
+        return found
@@ -1,4 +1,5 @@
 import math
+import itertools
 from enum import IntEnum
 import numpy as np
 import gym
@@ -137,8 +138,9 @@ class Room:
         # Lists of portals, indexed by wall/edge index
         self.portals = [[] for i in range(self.num_walls)]
 
-        # List of neighbor rooms
-        # Same length as list of portals
+        # List of neighbor rooms, as (room, p0, p1) tuples
+        # where p0 and p1 are the end points of the portal
+        # leading to the neighbor, filled by connect_rooms
         self.neighbors = []
 
     def add_portal(
@@ -235,16 +237,24 @@ class Room:
         # The point is inside if all the dot products are greater than zero
         return np.all(np.greater(dotNAP, 0))
 
-    def _gen_static_data(self, params, rng):
+    # Attributes set by _gen_static_data
+    STATIC_DATA_ATTRS = (
+        'floor_verts',
+        'floor_texcs',
+        'ceil_verts',
+        'ceil_texcs',
+        'wall_verts',
+        'wall_norms',
+        'wall_texcs',
+        'wall_segs',
+    )
+
+    def _load_textures(self, rng, max_tex_size=None):
         """
-        Generate polygons and static data for this room
-        Needed for rendering and collision detection
-        Note: the wall polygons are quads, but the floor and
-              ceiling can be arbitrary n-gons
+        Load the textures and do texture randomization
         """
 
-        # Load the textures and do texture randomization
-        self.wall_tex = Texture.get(self.wall_tex_name, rng)
+        self.wall_tex = Texture.get(self.wall_tex_name, rng, max_tex_size)
 
         # self.wall_tex_list = []
         # for idx in range(4):
@@ -253,8 +263,51 @@ class Room:
         #     )
 
 
-        self.floor_tex = Texture.get(self.floor_tex_name, rng)
-        self.ceil_tex = Texture.get(self.ceil_tex_name, rng)
+        self.floor_tex = Texture.get(self.floor_tex_name, rng, max_tex_size)
+        self.ceil_tex = Texture.get(self.ceil_tex_name, rng, max_tex_size)
+
+    def _get_layout_key(self):
+        """
+        Get a hashable key identifying everything the static data of this
+        room depends on: its outline, height, portals and textures
+        Textures are shared, so they are compared by identity.
+        """
+
+        portals = tuple(
+            tuple(
+                (portal['start_pos'], portal['end_pos'], portal['min_y'], portal['max_y'])
+                for portal in edge_portals
+            )
+            for edge_portals in self.portals
+        )
+
+        return (
+            self.outline.tobytes(),
+            self.wall_height,
+            self.no_ceiling,
+            portals,
+            self.wall_tex,
+            self.floor_tex,
+            self.ceil_tex,
+        )
+
+    def _copy_static_data(self, room):
+        """
+        Reuse the static data generated for a room with the same layout key
+        The arrays are shared, and must not be modified in place.
+        """
+
+        for attr in self.STATIC_DATA_ATTRS:
+            setattr(self, attr, getattr(room, attr))
+
+    def _gen_static_data(self):
+        """
+        Generate polygons and static data for this room
+        Needed for rendering and collision detection
+        The textures must be loaded first (see _load_textures)
+        Note: the wall polygons are quads, but the floor and
+              ceiling can be arbitrary n-gons
+        """
 
         # Generate the floor vertices
         self.floor_verts = self.outline
@@ -424,44 +477,50 @@ class Room:
         else:
             self.wall_texcs = np.array([]).reshape(0, 2)
 
-    def _render(self):
+    def _gen_render_data(self):
         """
-        Render the static elements of the room
+        Generate triangle vertex data for the static elements of the room
+        Returns a list of (texture, interleaved vertex array) pairs
         """
 
-        glColor3f(1, 1, 1)
+        render_data = []
 
-        # Draw the floor
-        self.floor_tex.bind()
-        glBegin(GL_POLYGON)
-        glNormal3f(0, 1, 0)
-        for i in range(self.floor_verts.shape[0]):
-            glTexCoord2f(*self.floor_texcs[i, :])
-            glVertex3f(*self.floor_verts[i, :])
-        glEnd()
+        # Triangulate the floor and ceiling polygons as fans (they are convex)
+        num_verts = self.outline.shape[0]
+        fan_idxs = np.stack([
+            np.zeros(num_verts - 2, dtype=int),
+            np.arange(1, num_verts - 1),
+            np.arange(2, num_verts)
+        ], axis=1).reshape(-1)
 
-        # Draw the ceiling
-        if not self.no_ceiling:
-            self.ceil_tex.bind()
-            glBegin(GL_POLYGON)
-            glNormal3f(0, -1, 0)
-            for i in range(self.ceil_verts.shape[0]):
-                glTexCoord2f(*self.ceil_texcs[i, :])
-                glVertex3f(*self.ceil_verts[i, :])
-            glEnd()
-
-        # Draw the walls
-        
-        self.wall_tex.bind()
-        # for idx in range(len(self.wall_tex_list)):
-        #     self.wall_tex_list[idx].bind()
+        # Floor
+        render_data.append((self.floor_tex, interleave_verts(
+            self.floor_verts[fan_idxs],
+            Y_VEC,
+            self.floor_texcs[fan_idxs]
+        )))
 
-        glBegin(GL_QUADS)
-        for i in range(self.wall_verts.shape[0]):
-            glNormal3f(*self.wall_norms[i, :])
-            glTexCoord2f(*self.wall_texcs[i, :])
-            glVertex3f(*self.wall_verts[i, :])
-        glEnd()
+        # Ceiling
+        if not self.no_ceiling:
+            render_data.append((self.ceil_tex, interleave_verts(
+                self.ceil_verts[fan_idxs],
+                -Y_VEC,
+                self.ceil_texcs[fan_idxs]
+            )))
+
+        # Walls, split each quad into two triangles
+        if self.wall_verts.shape[0] > 0:
+            quad_idxs = np.array([0, 1, 2, 0, 2, 3])
+            num_quads = self.wall_verts.shape[0] // 4
+            tri_idxs = (np.arange(num_quads)[:, None] * 4 + quad_idxs).reshape(-1)
+
+            render_data.append((self.wall_tex, interleave_verts(
+                self.wall_verts[tri_idxs],
+                self.wall_norms[tri_idxs],
+                self.wall_texcs[tri_idxs]
+            )))
+
+        return render_data
 
 class MiniWorldEnv(gym.Env):
     """
@@ -494,6 +553,33 @@ class MiniWorldEnv(gym.Env):
         # Done completing task
         done = 7
 
+    # Number of times the forward step is repeated by the move_forward
+    # action. Larger steps are made in a single move, with an observation
+    # rendered only at the end, instead of calling step() repeatedly
+    forward_repeat = 1
+
+    # Number of candidate positions tested one at a time by place_entity,
+    # which is fastest when most placements succeed on the first tries.
+    # After that, candidates are drawn in batches, starting small and
+    # doubling up to the maximum batch size with each batch of failed
+    # candidates, with a maximum number of batches before giving up
+    place_single_tries = 8
+    place_batch_size = 8
+    place_max_batch_size = 64
+    place_max_batches = 100
+
+    # Attributes set by _gen_static_data, reused along with the static
+    # data of the rooms when the floorplan is unchanged
+    LAYOUT_ATTRS = (
+        'wall_segs',
+        'wall_grid',
+        'room_probs',
+        'room_boxes',
+        'room_outlines',
+        'room_edge_norms',
+        'occupancy',
+    )
+
     def __init__(
         self,
         max_episode_steps=1500,
@@ -502,7 +588,11 @@ class MiniWorldEnv(gym.Env):
         window_width=800,
         window_height=600,
         params=DEFAULT_PARAMS,
-        domain_rand=False
+        domain_rand=False,
+        obs_fb_profile='quality',
+        obs_modalities=None,
+        max_tex_size=None,
+        occupancy_cell_size=None
     ):
         # Action enumeration for this environment
         self.actions = MiniWorldEnv.Actions
@@ -518,6 +608,31 @@ class MiniWorldEnv(gym.Env):
             dtype=np.uint8
         )
 
+        # Optional list of observation modalities ('rgb', 'depth', 'seg').
+        # When given, observations are dicts with one entry per modality
+        # (see render_obs_dict) instead of RGB images
+        self.obs_modalities = obs_modalities
+        if obs_modalities is not None:
+            obs_spaces = {
+                'rgb': self.observation_space,
+                'depth': spaces.Box(
+                    low=0,
+                    high=100.0,
+                    shape=(obs_height, obs_width, 1),
+                    dtype=np.float32
+                ),
+                'seg': spaces.Box(
+                    low=0,
+                    high=np.iinfo(np.int32).max,
+                    shape=(obs_height, obs_width, 1),
+                    dtype=np.int32
+                ),
+            }
+            assert set(obs_modalities) <= set(obs_spaces), obs_modalities
+            self.observation_space = spaces.Dict({
+                name: obs_spaces[name] for name in obs_modalities
+            })
+
         self.reward_range = (-math.inf, math.inf)
 
         # Maximum number of steps per episode
@@ -529,42 +644,133 @@ class MiniWorldEnv(gym.Env):
         # Domain randomization enable/disable flag
         self.domain_rand = domain_rand
 
+        # Asynchronous observation flag. When set, step() and reset()
+        # only start rendering the observation (see kick_render) and
+        # return None in its place, to be retrieved with collect_obs()
+        # This only applies to RGB observations, and raises a ValueError
+        # when obs_modalities is set
+        self.async_obs = False
+
+        # Deferred observation flag. When set, step() and reset() do not
+        # render the observation and return None in its place. This is
+        # used when rendering is done by the caller (eg: BatchedMiniWorld)
+        self.defer_obs = False
+
+        # Optional caller-provided array of shape (obs_height, obs_width, 3)
+        # and dtype uint8 (eg: a slot in a shared memory batch array).
+        # When set, step() and reset() write observations directly into it
+        # and return it, instead of allocating a new array at every step.
+        self.obs_out = None
+
+        # Maximum resolution of the room textures, in texels. Levels of
+        # detail much larger than the observations are never sampled, so
+        # they need not be uploaded. 'auto' uses the power of two at least
+        # 4 times the observation size, which leaves observations unchanged.
+        # Note that the human view is rendered with the same textures.
+        if max_tex_size == 'auto':
+            max_tex_size = 2 ** math.ceil(math.log2(4 * max(obs_width, obs_height)))
+        self.max_tex_size = max_tex_size
+
+        # Cell size of the optional occupancy grid, in meters. When set,
+        # the floorplan is rasterized once per layout into a grid of the
+        # distances to the walls (see OccupancyGrid), which is used to
+        # skip most exact collision tests and to place entities in free
+        # cells only. It is available as self.occupancy after reset.
+        self.occupancy_cell_size = occupancy_cell_size
+        self.occupancy = None
+
+        # Portal culling flag. When set, observations only draw the rooms
+        # and entities that can be seen through the portals connecting
+        # the room the agent is in to the rest of the world
+        self.portal_culling = True
+
         # Window for displaying the environment to humans
         self.window = None
 
         # Invisible window to render into (shadow OpenGL context)
-        self.shadow_window = pyglet.window.Window(width=1, height=1, visible=False)
+        # Headless EGL is used automatically when no display is available
+        self.shadow_window = get_shadow_window()
+        make_current(self.shadow_window)
 
         # Enable depth testing and backface culling
         glEnable(GL_DEPTH_TEST)
         glEnable(GL_CULL_FACE)
 
-        # Frame buffer used to render observations
-        self.obs_fb = FrameBuffer(obs_width, obs_height, 8)
+        # The projection matrices flip the Y axis (see _load_projection),
+        # which reverses the winding order of front-facing polygons
+        glFrontFace(GL_CW)
 
-        # Frame buffer used for human visualization
-        self.vis_fb = FrameBuffer(window_width, window_height, 16)
+        # Single light, with the vertex colors as material colors
+        # Its position and colors are set for each frame (see _set_lighting)
+        glEnable(GL_LIGHT0)
+        glShadeModel(GL_SMOOTH)
+        glEnable(GL_COLOR_MATERIAL)
+        glColorMaterial(GL_FRONT_AND_BACK, GL_AMBIENT_AND_DIFFUSE)
+
+        # Frame buffer used to render observations
+        # The profile is either a key of FB_PROFILES or a dict of
+        # FrameBuffer arguments (num_samples, color_format)
+        self.obs_fb = FrameBuffer(obs_width, obs_height, **get_fb_profile(obs_fb_profile))
+
+        # Frame buffer used to render segmentation maps, created when first
+        # needed. Multisampling is disabled so that IDs are never blended.
+        self.seg_fb = None
+
+        # OpenGL objects owned by this environment. The OpenGL context is
+        # shared by all environments in the process (as are the textures
+        # and meshes), so these are allocated per environment and
+        # released by close(). The static scene is rebuilt by
+        # _render_static at the beginning of each episode, except for
+        # the room vertex buffers, kept while the floorplan is unchanged.
+        self.room_vbufs = []
+        self.room_vbufs_key = None
+        self.ent_batches = {}
+        self.static_ents = []
+        self.static_lists = 0
+
+        # Frame buffer used for human visualization, and label for
+        # displaying text, created on first use by render()
+        self.window_width = window_width
+        self.window_height = window_height
+        self.vis_fb = None
+        self.text_label = None
 
         # Compute the observation display size
         self.obs_disp_width = 256
         self.obs_disp_height = obs_height * (self.obs_disp_width / obs_width)
 
-        # For displaying text
-        self.text_label = pyglet.text.Label(
-            font_name="Arial",
-            font_size=14,
-            multiline=True,
-            width=400,
-            x = window_width + 5,
-            y = window_height - (self.obs_disp_height + 19)
-        )
+        # Static data of the last floorplan generated, reused by the next
+        # episodes as long as the floorplan is the same (see _gen_static_data)
+        self.layout_key = None
+        self.layout_cache = None
 
         # Initialize the state
         self.seed()
         self.reset()
 
     def close(self):
-        pass
+        """
+        Release the OpenGL resources owned by this environment
+        """
+
+        if self.obs_fb is None:
+            return
+
+        make_current(self.shadow_window)
+
+        self._delete_static()
+        self._delete_room_vbufs()
+
+        for frame_buffer in (self.obs_fb, self.vis_fb, self.seg_fb):
+            if frame_buffer is not None:
+                frame_buffer.delete()
+        self.obs_fb = None
+        self.vis_fb = None
+        self.seg_fb = None
+
+        if self.window:
+            self.window.close()
+            self.window = None
 
     def seed(self, seed=None):
         self.rand = RandGen(seed)
@@ -582,8 +788,8 @@ class MiniWorldEnv(gym.Env):
         # Create the agent
         self.agent = Agent()
 
-        # List of entities contained
-        self.entities = []
+        # List of entities contained, with a spatial hash of their positions
+        self.entities = EntityList()
 
         # List of rooms in the world
         self.rooms = []
@@ -627,7 +833,7 @@ class MiniWorldEnv(gym.Env):
         self._render_static()
 
         # Generate the first camera image
-        obs = self.render_obs()
+        obs = self._gen_obs()
 
         # Return first observation
         return obs
@@ -657,14 +863,16 @@ class MiniWorldEnv(gym.Env):
             self.agent.right_vec * fwd_drift
         )
 
-        if self.intersect(self.agent, next_pos, self.agent.radius):
+        # Test the whole path, so that long moves can't go through
+        # obstacles. The object being carried moves along with the agent.
+        carrying = self.agent.carrying
+        if self.intersect_swept(self.agent, self.agent.pos, next_pos, self.agent.radius, carrying):
             return False
 
-        carrying = self.agent.carrying
         if carrying:
             next_carrying_pos = self._get_carry_pos(next_pos, carrying)
 
-            if self.intersect(carrying, next_carrying_pos, carrying.radius):
+            if self.intersect_swept(carrying, carrying.pos, next_carrying_pos, carrying.radius):
                 return False
 
             carrying.pos = next_carrying_pos
@@ -701,7 +909,11 @@ class MiniWorldEnv(gym.Env):
         Perform one action and update the simulation
         """
 
-        self.step_count += 1
+        # Repeated forward moves count as that many steps
+        if action == self.actions.move_forward:
+            self.step_count += self.forward_repeat
+        else:
+            self.step_count += 1
 
         rand = self.rand if self.domain_rand else None
         fwd_step = self.params.sample(rand, 'forward_step')
@@ -709,7 +921,10 @@ class MiniWorldEnv(gym.Env):
         turn_step = self.params.sample(rand, 'turn_step')
 
         if action == self.actions.move_forward:
-            self.move_agent(fwd_step, fwd_drift)
+            # Make as many of the repeated moves as possible at once
+            for num_moves in range(self.forward_repeat, 0, -1):
+                if self.move_agent(num_moves * fwd_step, num_moves * fwd_drift):
+                    break
 
         elif action == self.actions.move_back:
             self.move_agent(-fwd_step, fwd_drift)
@@ -743,7 +958,7 @@ class MiniWorldEnv(gym.Env):
             self.agent.carrying.dir = self.agent.dir
 
         # Generate the current camera image
-        obs = self.render_obs()
+        obs = self._gen_obs()
 
         # If the maximum time step count is reached
         if self.step_count >= self.max_episode_steps:
@@ -858,6 +1073,8 @@ class MiniWorldEnv(gym.Env):
 
         # If the portals are directly connected, stop
         if np.linalg.norm(a - d) < 0.001:
+            room_a.neighbors.append((room_b, a, b))
+            room_b.neighbors.append((room_a, c, d))
             return
 
         len_a = np.linalg.norm(b - a)
@@ -883,6 +1100,11 @@ class MiniWorldEnv(gym.Env):
         room.add_portal(1, start_pos=0, end_pos=len_a)
         room.add_portal(3, start_pos=0, end_pos=len_b)
 
+        room_a.neighbors.append((room, a, b))
+        room.neighbors.append((room_a, a, b))
+        room_b.neighbors.append((room, c, d))
+        room.neighbors.append((room_b, c, d))
+
     def place_entity(
         self,
         ent,
@@ -897,6 +1119,8 @@ class MiniWorldEnv(gym.Env):
         """
         Place an entity/object in the world.
         Find a position that doesn't intersect with any other object.
+        Candidate positions are tested one at a time, and then in batches
+        if those all fail. RuntimeError is raised if none can be found.
         """
 
         assert len(self.rooms) > 0, "create rooms before calling place_entity"
@@ -913,39 +1137,119 @@ class MiniWorldEnv(gym.Env):
             self.entities.append(ent)
             return ent
 
-        # Keep retrying until we find a suitable position
-        while True:
-            # Pick a room, sample rooms proportionally to floor surface area
-            r = room if room else self.rand.choice(self.rooms, probs=self.room_probs)
-
-            # Choose a random point within the square bounding box of the room
-            lx = r.min_x if min_x == None else min_x
-            hx = r.max_x if max_x == None else max_x
-            lz = r.min_z if min_z == None else min_z
-            hz = r.max_z if max_z == None else max_z
-            pos = self.rand.float(
-                low =[lx + ent.radius, 0, lz + ent.radius],
-                high=[hx - ent.radius, 0, hz - ent.radius]
-            )
+        radius = ent.radius
+
+        # Rooms to pick from, proportionally to floor surface area
+        if room:
+            room_ids = np.array([self.rooms.index(room)])
+            probs = None
+        else:
+            room_ids = np.arange(len(self.rooms))
+            probs = self.room_probs
+
+        # Cells of the occupancy grid to pick from, when enabled,
+        # unless the positions are restricted to a box
+        cells = None
+        if self.occupancy is not None and (min_x, max_x, min_z, max_z) == (None,) * 4:
+            cells = self.occupancy.get_place_cells(radius, room_ids[0] if room else None)
+            if len(cells) == 0:
+                raise RuntimeError('no free space to place the entity in')
+
+        for _ in range(self.place_single_tries):
+            # Choose a random point within a random free cell, or
+            # within the bounding box of a random room
+            if cells is not None:
+                points, room_idxs = self.occupancy.sample(self.rand, cells, 1)
+                pos = points[0]
+                r = self.rooms[room_idxs[0]]
+            else:
+                r = room if room else self.rand.choice(self.rooms, probs=self.room_probs)
+                lx = r.min_x if min_x == None else min_x
+                hx = r.max_x if max_x == None else max_x
+                lz = r.min_z if min_z == None else min_z
+                hz = r.max_z if max_z == None else max_z
+                pos = self.rand.float(
+                    low =[lx + radius, 0, lz + radius],
+                    high=[hx - radius, 0, hz - radius]
+                )
 
             # Make sure the position is within the room's outline
             if not r.point_inside(pos):
                 continue
 
             # Make sure the position doesn't intersect with any walls
-            if self.intersect(ent, pos, ent.radius):
+            # or other entities
+            if self.intersect(ent, pos, radius):
                 continue
 
             # Pick a direction
-            d = dir if dir != None else self.rand.float(-math.pi, math.pi)
-
+            ent.dir = dir if dir != None else self.rand.float(-math.pi, math.pi)
             ent.pos = pos
-            ent.dir = d
-            break
+            self.entities.append(ent)
+
+            return ent
+
+        # Boxes to sample positions in, as (min_x, max_x, min_z, max_z) rows
+        boxes = self.room_boxes[room_ids].astype(float)
+        for col, bound in enumerate((min_x, max_x, min_z, max_z)):
+            if bound is not None:
+                boxes[:, col] = bound
+
+        # Sampling ranges of the X, Y and Z coordinates in each box
+        low = np.zeros((len(boxes), 3))
+        high = np.zeros((len(boxes), 3))
+        low[:, [0, 2]] = boxes[:, [0, 2]] + radius
+        high[:, [0, 2]] = boxes[:, [1, 3]] - radius
+
+        # Positions and radii of the other entities
+        others = [e for e in self.entities if e is not ent and e.pos is not None]
+        other_pos = np.array([(e.pos[0], e.pos[2]) for e in others]).reshape(-1, 2)
+        min_dists = radius + np.array([e.radius for e in others])
+
+        num = self.place_batch_size
+        num_tries = self.place_single_tries
+
+        for _ in range(self.place_max_batches):
 
-        self.entities.append(ent)
+            # Choose random points within random free cells, or
+            # within the bounding boxes of random rooms
+            if cells is not None:
+                points, room_idxs = self.occupancy.sample(self.rand, cells, num)
+            else:
+                if len(boxes) > 1:
+                    box_idxs = self.rand.choice_idxs(len(boxes), num, probs)
+                else:
+                    box_idxs = np.zeros(num, dtype=int)
+                points = self.rand.float(low=low[box_idxs], high=high[box_idxs])
+                room_idxs = room_ids[box_idxs]
+
+            # Make sure the positions are within the outlines of their rooms
+            ap = points[:, None, :] - self.room_outlines[room_idxs]
+            valid = ((self.room_edge_norms[room_idxs] * ap).sum(axis=2) > 0).all(axis=1)
+
+            # Make sure the positions don't intersect with the walls
+            valid &= ~intersect_circles_segs(points, radius, self.wall_segs)
+
+            # Make sure the positions don't intersect with other entities
+            if len(others) > 0:
+                diffs = points[:, None, [0, 2]] - other_pos
+                valid &= ~((diffs * diffs).sum(axis=2) < min_dists * min_dists).any(axis=1)
 
-        return ent
+            # Use the first valid position
+            if valid.any():
+                # Pick a direction
+                ent.dir = dir if dir != None else self.rand.float(-math.pi, math.pi)
+                ent.pos = points[valid.argmax()].copy()
+                self.entities.append(ent)
+
+                return ent
+
+            num_tries += num
+            num = min(2 * num, self.place_max_batch_size)
+
+        raise RuntimeError(
+            'could not find a free position for the entity after {} tries'.format(num_tries)
+        )
 
     def place_agent(
         self,
@@ -982,24 +1286,31 @@ class MiniWorldEnv(gym.Env):
         px, _, pz = pos
         pos = np.array([px, 0, pz])
 
-        # Check for intersection with walls
-        if intersect_circle_segs(pos, radius, self.wall_segs):
+        # Check for intersection with walls, using the occupancy
+        # grid when enabled to skip most exact tests
+        walls = self.occupancy if self.occupancy is not None else self.wall_grid
+        if walls.intersect_circle(pos, radius):
             return True
 
         # Check for entity intersection
-        for ent2 in self.entities:
-            # Entities can't intersect with themselves
-            if ent2 is ent:
-                continue
+        # Entities can't intersect with themselves
+        return self.entities.intersect(pos, radius, exclude=ent)
 
-            px, _, pz = ent2.pos
-            pos2 = np.array([px, 0, pz])
+    def intersect_swept(self, ent, p0, p1, radius, other=None):
+        """
+        Check if an entity moving in a straight line from p0 to p1
+        intersects with the world along the way. Another entity
+        moving along with it can be given, to be ignored.
+        """
 
-            d = np.linalg.norm(pos2 - pos)
-            if d < radius + ent2.radius:
-                return ent2
+        # Check for intersection with walls
+        walls = self.occupancy if self.occupancy is not None else self.wall_grid
+        if walls.intersect_swept_circle(p0, p1, radius):
+            return True
 
-        return None
+        # Check for entity intersection
+        # Entities can't intersect with themselves
+        return self.entities.intersect_swept(p0, p1, radius, exclude=(ent, other))
 
     def near(self, ent0, ent1=None):
         """
@@ -1019,27 +1330,78 @@ class MiniWorldEnv(gym.Env):
         """
 
         rand = self.rand if self.params.sample(self.rand, 'tex_rand') else None
-        return Texture.get(tex_name, rand)
+        return Texture.get(tex_name, rand, self.max_tex_size)
 
     def _gen_static_data(self):
         """
         Generate static data needed for rendering and collision detection
         """
 
+        # Load the textures of each room, before anything else, so
+        # that texture randomization draws the same random numbers
+        # whether or not the layout cache is used
+        rng = self.rand if self.domain_rand else None
+        for room in self.rooms:
+            room._load_textures(rng, self.max_tex_size)
+
+        # Many environments generate the same floorplan at every reset,
+        # in which case the static data of the last episode is reused
+        self.layout_key = tuple(room._get_layout_key() for room in self.rooms)
+        if self.layout_cache is not None and self.layout_cache[0] == self.layout_key:
+            _, rooms, data = self.layout_cache
+            for room, cached_room in zip(self.rooms, rooms):
+                room._copy_static_data(cached_room)
+            for attr, value in data.items():
+                setattr(self, attr, value)
+            return
+
         # Generate the static data for each room
         for room in self.rooms:
-            room._gen_static_data(
-                self.params,
-                self.rand if self.domain_rand else None
-            )
+            room._gen_static_data()
 
         # Concatenate the wall segments
         self.wall_segs = np.concatenate([r.wall_segs for r in self.rooms])
 
+        # Grid index of the wall segments, for collision detection
+        self.wall_grid = SegmentGrid(self.wall_segs)
+
         # Room selection probabilities
         self.room_probs = np.array([r.area for r in self.rooms], dtype=float)
         self.room_probs /= np.sum(self.room_probs)
 
+        # Room extents, used to find which room entities are in
+        self.room_boxes = np.array([
+            [room.min_x, room.max_x, room.min_z, room.max_z] for room in self.rooms
+        ]).reshape(-1, 4)
+
+        # Outlines and edge normals of the rooms, used to test which room
+        # points are in, all at once. Rooms with fewer walls repeat their
+        # first edge, which leaves the test unchanged.
+        max_walls = max(room.num_walls for room in self.rooms)
+        self.room_outlines = np.zeros((len(self.rooms), max_walls, 3))
+        self.room_edge_norms = np.zeros((len(self.rooms), max_walls, 3))
+        for room_idx, room in enumerate(self.rooms):
+            self.room_outlines[room_idx] = room.outline[0]
+            self.room_outlines[room_idx, :room.num_walls] = room.outline
+            self.room_edge_norms[room_idx] = room.edge_norms[0]
+            self.room_edge_norms[room_idx, :room.num_walls] = room.edge_norms
+
+        # Occupancy grid of the floorplan
+        self.occupancy = None
+        if self.occupancy_cell_size is not None:
+            self.occupancy = OccupancyGrid(
+                self.wall_grid,
+                self.room_boxes,
+                self.room_outlines,
+                self.room_edge_norms,
+                cell_size=self.occupancy_cell_size
+            )
+
+        self.layout_cache = (self.layout_key, self.rooms, {
+            attr: getattr(self, attr)
+            for attr in self.LAYOUT_ATTRS
+        })
+
     def _gen_world(self):
         """
         Generate the world. Derived classes must implement this method.
@@ -1056,76 +1418,318 @@ class MiniWorldEnv(gym.Env):
 
     def _render_static(self):
         """
-        Render the static elements of the scene into a display list.
+        Render the static elements of the scene into display lists,
+        and upload the room geometry into vertex buffers.
         Called once at the beginning of each episode.
         """
 
-        # TODO: manage this automatically
-        # glIsList
-        glDeleteLists(1, 1);
-        glNewList(1, GL_COMPILE);
+        # Release the resources of the previous episode
+        self._delete_static()
+
+        # The room geometry only needs to be uploaded again
+        # if the floorplan changed since the last episode
+        if self.room_vbufs_key != self.layout_key:
+            self._delete_room_vbufs()
+            self._upload_rooms()
+            self.room_vbufs_key = self.layout_key
+
+        # Portal graph used for culling, with the neighbors of each room
+        # as (room index, x0, z0, x1, z1) tuples of the portal end points
+        room_idxs = {room: idx for idx, room in enumerate(self.rooms)}
+        self.portal_graph = [
+            [
+                (room_idxs[nbr], float(p0[0]), float(p0[2]), float(p1[0]), float(p1[2]))
+                for nbr, p0, p1 in room.neighbors
+            ]
+            for room in self.rooms
+        ]
 
-        # Light position
-        glLightfv(GL_LIGHT0, GL_POSITION, (GLfloat*4)(*self.light_pos + [1]))
+        # Render each static entity into its own display list,
+        # so that they can be culled individually
+        self.static_ents = [ent for ent in self.entities if ent.is_static]
+        if len(self.static_ents) > 0:
+            self.static_lists = glGenLists(len(self.static_ents))
 
-        # Background/minimum light level
-        glLightfv(GL_LIGHT0, GL_AMBIENT, (GLfloat*4)(*self.light_ambient))
+        state = get_gl_state()
+        for ent_idx, ent in enumerate(self.static_ents):
+            state.new_list(self.static_lists + ent_idx)
+            glEnable(GL_TEXTURE_2D)
+            ent.render()
+            state.end_list()
 
-        # Diffuse light color
-        glLightfv(GL_LIGHT0, GL_DIFFUSE, (GLfloat*4)(*self.light_color))
+    def _upload_rooms(self):
+        """
+        Upload the room geometry into vertex buffers
+        """
 
-        #glLightf(GL_LIGHT0, GL_SPOT_CUTOFF, 180)
-        #glLightf(GL_LIGHT0, GL_SPOT_EXPONENT, 0)
-        #glLightf(GL_LIGHT0, GL_CONSTANT_ATTENUATION, 0)
-        #glLightf(GL_LIGHT0, GL_LINEAR_ATTENUATION, 0)
-        #glLightf(GL_LIGHT0, GL_QUADRATIC_ATTENUATION, 0)
+        # Group the room triangles by texture, so that the
+        # whole static world can be drawn with a few draw calls
+        tex_data = {}
+        for room_idx, room in enumerate(self.rooms):
+            for tex, data in room._gen_render_data():
+                tex_data.setdefault(tex, []).append((room_idx, data))
+
+        # Upload one vertex buffer per texture, and keep track of the
+        # range of vertices each room occupies in it, for culling
+        for tex, room_data in tex_data.items():
+            firsts = np.zeros(len(self.rooms), dtype=np.int32)
+            counts = np.zeros(len(self.rooms), dtype=np.int32)
+            first = 0
+            for room_idx, data in room_data:
+                firsts[room_idx] = first
+                counts[room_idx] = data.shape[0]
+                first += data.shape[0]
+
+            vbuf = VertexBuffer(np.concatenate([data for _, data in room_data]))
+            self.room_vbufs.append((tex, vbuf, firsts, counts))
+
+    def _delete_room_vbufs(self):
+        """
+        Release the vertex buffers created by _upload_rooms
+        """
 
-        glEnable(GL_LIGHTING)
-        glEnable(GL_LIGHT0)
+        for tex, vbuf, firsts, counts in self.room_vbufs:
+            vbuf.delete()
+        self.room_vbufs = []
+        self.room_vbufs_key = None
 
-        glShadeModel(GL_SMOOTH)
-        glEnable(GL_COLOR_MATERIAL)
-        glColorMaterial(GL_FRONT_AND_BACK, GL_AMBIENT_AND_DIFFUSE)
+    def _delete_static(self):
+        """
+        Release the OpenGL objects created by _render_static for the
+        entities. The room vertex buffers are kept for the next episode.
+        """
 
-        # Render the rooms
-        glEnable(GL_TEXTURE_2D)
-        for room in self.rooms:
-            room._render()
+        # Don't leave the vertex arrays pointing into deleted buffers
+        get_gl_state().release_vertex_arrays()
 
-        # Render the static entities
-        for ent in self.entities:
-            if ent.is_static:
-                ent.render()
+        # Batches for the dynamic entities, created when first drawn
+        for batch in self.ent_batches.values():
+            batch.delete()
+        self.ent_batches = {}
+
+        if self.static_lists:
+            glDeleteLists(self.static_lists, len(self.static_ents))
+        self.static_ents = []
+        self.static_lists = 0
+
+    def _render_rooms(self, textured=True, vis_rooms=None):
+        """
+        Draw the rooms from the vertex buffers created by _render_static
+        If a mask of visible rooms is given, only those rooms are drawn
+        """
+
+        state = get_gl_state()
+        if textured:
+            state.enable(GL_TEXTURE_2D)
+        else:
+            state.disable(GL_TEXTURE_2D)
+
+        for tex, vbuf, firsts, counts in self.room_vbufs:
+            tex.bind()
+            if vis_rooms is None:
+                vbuf.draw(GL_TRIANGLES)
+            else:
+                sel = vis_rooms & (counts > 0)
+                if sel.any():
+                    vbuf.draw_multi(firsts[sel], counts[sel])
 
-        glEndList()
+        state.disable(GL_TEXTURE_2D)
+
+    def _set_lighting(self):
+        """
+        Set up the light for the current frame. The lighting is not part of
+        the static display lists, so that randomizing it does not require
+        recompiling them. The light position is transformed by the current
+        modelview matrix, and so must be set after the camera.
+        """
+
+        state = get_gl_state()
+        state.enable(GL_LIGHTING)
+
+        # Light position
+        glLightfv(GL_LIGHT0, GL_POSITION, (GLfloat*4)(*self.light_pos + [1]))
+
+        # Background/minimum light level
+        state.set_light(GL_LIGHT0, GL_AMBIENT, self.light_ambient)
+
+        # Diffuse light color
+        state.set_light(GL_LIGHT0, GL_DIFFUSE, self.light_color)
 
     def _render_world(
         self,
-        frame_buffer,
-        render_agent
+        render_agent,
+        vis_rooms=None
     ):
         """
-        Render the world from a given camera position into a frame buffer,
-        and produce a numpy image array as output.
+        Render the world from a given camera position into
+        the frame buffer currently bound
+        If a mask of visible rooms is given, only the rooms
+        and entities that may be visible are drawn
         """
 
-        # Call the display list for the static parts of the environment
-        glCallList(1)
+        # Set up the lighting
+        self._set_lighting()
+
+        # Render the static entities
+        ent_mask = self._get_ent_mask(self.static_ents, vis_rooms)
+        for ent_idx in np.flatnonzero(ent_mask):
+            glCallList(self.static_lists + ent_idx)
+
+        # The display lists toggle texturing
+        get_gl_state().invalidate(GL_TEXTURE_2D)
+
+        # Draw the rooms
+        self._render_rooms(vis_rooms=vis_rooms)
 
-        # TODO: keep the non-static entities in a different list for efficiency?
         # Render the non-static entities
-        for ent in self.entities:
-            if not ent.is_static and ent is not self.agent:
-                ent.render()
-                #ent.draw_bound()
+        self._render_dynamic_ents(vis_rooms)
 
         if render_agent:
             self.agent.render()
 
-        # Resolve the rendered image into a numpy array
-        img = frame_buffer.resolve()
+    def _render_dynamic_ents(self, vis_rooms=None):
+        """
+        Draw the non-static entities, batching together
+        the entities that share the same geometry
+        """
 
-        return img
+        ents = [
+            ent for ent in self.entities
+            if not ent.is_static and ent is not self.agent
+        ]
+        ent_mask = self._get_ent_mask(ents, vis_rooms)
+
+        groups = {}
+        for ent in itertools.compress(ents, ent_mask):
+            key = ent.batch_key
+            if key is None:
+                ent.render()
+            else:
+                groups.setdefault(key, []).append(ent)
+
+        draws = []
+        for key, ents in groups.items():
+            if key not in self.ent_batches:
+                self.ent_batches[key] = EntityBatch(ents[0])
+            draws += self.ent_batches[key].get_draws(ents)
+
+        # Draw the batches sorted by texture, across the whole frame
+        draws.sort(key=lambda draw: draw[1].id if draw[1] else 0)
+        draw_ranges(draws)
+
+    def _get_visible_rooms(self, aspect):
+        """
+        Find the rooms that may be visible from the agent's camera, by
+        walking the portal graph from the room the camera is in and
+        narrowing the horizontal view angle through each portal.
+        Returns a boolean mask over self.rooms, or None if all
+        rooms should be drawn.
+        """
+
+        if not self.portal_culling:
+            return None
+
+        # Rooms without a ceiling can be seen over the walls
+        if any(room.no_ceiling for room in self.rooms):
+            return None
+
+        cam_pos = self.agent.cam_pos
+        cam_x, _, cam_z = cam_pos
+
+        # Find the room the camera is in, only testing
+        # the rooms whose extents contain the camera
+        boxes = self.room_boxes
+        start_room = None
+        for room_idx in np.flatnonzero(
+            (boxes[:, 0] <= cam_x) & (cam_x <= boxes[:, 1]) &
+            (boxes[:, 2] <= cam_z) & (cam_z <= boxes[:, 3])
+        ):
+            if self.rooms[room_idx].point_inside(cam_pos):
+                start_room = room_idx
+                break
+
+        # The camera is in a doorway or outside of the world
+        if start_room is None:
+            return None
+
+        # Horizontal half-angle of the view frustum. When the camera
+        # is pitched, the far corners of the frustum spread out more.
+        tan_y = math.tan(self.agent.cam_fov_y * math.pi / 360)
+        tan_x = tan_y * aspect
+        pitch = abs(self.agent.cam_pitch) * math.pi / 180
+        fwd = math.cos(pitch) - tan_y * math.sin(pitch)
+        if fwd <= 0:
+            return None
+        half_fov = math.atan2(tan_x, fwd)
+
+        # Angle of a point relative to the camera direction, in the XZ plane
+        fx, _, fz = self.agent.dir_vec
+        rx, _, rz = self.agent.right_vec
+        def get_angle(x, z):
+            dx = x - cam_x
+            dz = z - cam_z
+            return math.atan2(dx * rx + dz * rz, dx * fx + dz * fz)
+
+        # Slack added to portal extents, to avoid popping at the edges
+        margin = 0.01
+
+        vis_rooms = np.zeros(len(self.rooms), dtype=bool)
+
+        # Depth-first traversal, keeping the rooms along the current path
+        # so that cycles in the portal graph are not followed
+        stack = [(start_room, -half_fov, half_fov, (start_room,))]
+        while len(stack) > 0:
+            room, min_a, max_a, path = stack.pop()
+            vis_rooms[room] = True
+
+            for neighbor, x0, z0, x1, z1 in self.portal_graph[room]:
+                if neighbor in path:
+                    continue
+
+                a0 = get_angle(x0, z0)
+                a1 = get_angle(x1, z1)
+                p_min = min(a0, a1) - margin
+                p_max = max(a0, a1) + margin
+
+                # The portal is behind the camera, this only happens with
+                # very wide fields of view. Be conservative.
+                if p_max - p_min > math.pi:
+                    p_min, p_max = -math.pi, math.pi
+
+                p_min = max(p_min, min_a)
+                p_max = min(p_max, max_a)
+                if p_min < p_max:
+                    stack.append((neighbor, p_min, p_max, path + (neighbor,)))
+
+        return vis_rooms
+
+    def _get_ent_mask(self, ents, vis_rooms):
+        """
+        Get a boolean mask of the entities that may be visible,
+        given a mask of the visible rooms. Entities are kept if their
+        bounding circle overlaps a visible room, or no room at all.
+        """
+
+        if vis_rooms is None or len(ents) == 0:
+            return np.ones(len(ents), dtype=bool)
+
+        pos = np.array([ent.pos for ent in ents])
+        # Frames have no collision radius, but extend along the wall
+        radius = np.array([
+            max(ent.radius, getattr(ent, 'width', 0) / 2) for ent in ents
+        ])[:, None]
+
+        x = pos[:, 0:1]
+        z = pos[:, 2:3]
+        boxes = self.room_boxes
+        overlap = (
+            (x + radius >= boxes[:, 0]) &
+            (x - radius <= boxes[:, 1]) &
+            (z + radius >= boxes[:, 2]) &
+            (z - radius <= boxes[:, 3])
+        )
+
+        return ~overlap.any(axis=1) | (overlap & vis_rooms).any(axis=1)
 
     def render_top_view(self, frame_buffer=None):
         """
@@ -1137,15 +1741,13 @@ class MiniWorldEnv(gym.Env):
 
         # Switch to the default OpenGL context
         # This is necessary on Linux Nvidia drivers
-        self.shadow_window.switch_to()
+        make_current(self.shadow_window)
 
         # Bind the frame buffer before rendering into it
         frame_buffer.bind()
 
         # Clear the color and depth buffers
-        glClearColor(*self.sky_color, 1.0)
-        glClearDepth(1.0)
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        get_gl_state().clear((*self.sky_color, 1.0))
 
         # Scene extents to render
         min_x = self.min_x - 1
@@ -1173,15 +1775,14 @@ class MiniWorldEnv(gym.Env):
             max_x += w_diff / 2
 
         # Set the projection matrix
-        glMatrixMode(GL_PROJECTION)
-        glLoadIdentity()
-        glOrtho(
-            min_x,
-            max_x,
-            -max_z,
-            -min_z,
-            -100, 100.0
-        )
+        if self._load_projection(('ortho', min_x, max_x, min_z, max_z)):
+            glOrtho(
+                min_x,
+                max_x,
+                -max_z,
+                -min_z,
+                -100, 100.0
+            )
 
         # Setup the camera
         # Y maps to +Z, Z maps to +Y
@@ -1195,40 +1796,121 @@ class MiniWorldEnv(gym.Env):
         ]
         glLoadMatrixf((GLfloat * len(m))(*m))
 
-        return self._render_world(
-            frame_buffer,
-            render_agent=True
-        )
+        self._render_world(render_agent=True)
+
+        # Resolve the rendered image into a numpy array
+        return frame_buffer.resolve()
 
-    def render_obs(self, frame_buffer=None):
+    def _load_projection(self, key):
+        """
+        Reset the projection matrix, flipping the Y axis so that
+        glReadPixels produces rows in top-to-bottom order, as expected
+        for numpy images, without having to flip and copy the images
+        The key identifies the projection the caller then multiplies in.
+        If it is already loaded, the matrix is left as is and False is
+        returned, so that the caller can skip setting it up again.
+        """
+
+        if not get_gl_state().set_projection(key):
+            return False
+
+        glMatrixMode(GL_PROJECTION)
+        glLoadIdentity()
+        glScalef(1, -1, 1)
+
+        return True
+
+    def render_obs(self, frame_buffer=None, out=None):
         """
         Render an observation from the point of view of the agent
+        If an output array is given, the image is written directly into it
         """
 
         if frame_buffer == None:
             frame_buffer = self.obs_fb
 
+        self._draw_obs(frame_buffer)
+
+        # Resolve the rendered image into a numpy array
+        return frame_buffer.resolve(out)
+
+    def kick_render(self):
+        """
+        Start rendering an observation from the point of view of the agent,
+        without waiting for the GPU to produce it. The observation must
+        then be retrieved with collect_obs(). This makes it possible to
+        overlap rendering with simulation and inter-process communication.
+        """
+
+        self._draw_obs(self.obs_fb)
+        self.obs_fb.read_async()
+
+    def collect_obs(self, out=None):
+        """
+        Retrieve the observation started by the oldest kick_render() call
+        If an output array is given, the image is written directly into it
+        """
+
+        if out is None:
+            out = self.obs_out
+
+        return self.obs_fb.collect(out)
+
+    def _gen_obs(self):
+        """
+        Generate the observation returned by reset() and step()
+        """
+
+        if self.defer_obs:
+            return None
+
+        if self.obs_modalities is not None:
+            if self.async_obs:
+                raise ValueError('async_obs is not supported with obs_modalities')
+            return self.render_obs_dict()
+
+        if self.async_obs:
+            self.kick_render()
+            return None
+
+        return self.render_obs(out=self.obs_out)
+
+    def _draw_obs(self, frame_buffer, viewport=None, seg=False):
+        """
+        Draw the world from the point of view of the agent into a frame buffer
+        If a viewport (x, y, width, height) is given, only that region
+        of the frame buffer is drawn into
+        If the seg flag is set, the segmentation IDs are drawn (see render_seg)
+        """
+
         # Switch to the default OpenGL context
         # This is necessary on Linux Nvidia drivers
-        self.shadow_window.switch_to()
+        make_current(self.shadow_window)
 
         # Bind the frame buffer before rendering into it
-        frame_buffer.bind()
+        if viewport is None:
+            frame_buffer.bind()
+            width, height = frame_buffer.width, frame_buffer.height
+        else:
+            frame_buffer.bind_viewport(*viewport)
+            width, height = viewport[2:]
 
         # Clear the color and depth buffers
-        glClearColor(*self.sky_color, 1.0)
-        glClearDepth(1.0)
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        # The sky has ID 0 in segmentation maps
+        if seg:
+            get_gl_state().clear((0, 0, 0, 1.0))
+        else:
+            get_gl_state().clear((*self.sky_color, 1.0))
 
         # Set the projection matrix
-        glMatrixMode(GL_PROJECTION)
-        glLoadIdentity()
-        gluPerspective(
-            self.agent.cam_fov_y,
-            frame_buffer.width / float(frame_buffer.height),
-            0.04,
-            100.0
-        )
+        aspect = width / float(height)
+        if self._load_projection(('perspective', self.agent.cam_fov_y, aspect)):
+            gluPerspective(
+                self.agent.cam_fov_y,
+                aspect,
+                0.04,
+                100.0
+            )
 
         # Setup the camera
         glMatrixMode(GL_MODELVIEW)
@@ -1242,10 +1924,11 @@ class MiniWorldEnv(gym.Env):
             0, 1.0, 0.0
         )
 
-        return self._render_world(
-            frame_buffer,
-            render_agent=False
-        )
+        vis_rooms = self._get_visible_rooms(width / float(height))
+        if seg:
+            self._render_seg(vis_rooms)
+        else:
+            self._render_world(render_agent=False, vis_rooms=vis_rooms)
 
     def render_depth(self, frame_buffer=None):
         """
@@ -1258,10 +1941,139 @@ class MiniWorldEnv(gym.Env):
             frame_buffer = self.obs_fb
 
         # Render the world
-        self.render_obs(frame_buffer)
+        self._draw_obs(frame_buffer)
 
         return frame_buffer.get_depth_map(0.04, 100.0)
 
+    def render_seg(self):
+        """
+        Produce an instance segmentation map of the agent's view
+        Values are integer IDs, map shape is (H,W,1)
+        ID 0 is the sky, IDs 1 to len(self.rooms) are the rooms, and
+        the entities come next, in order (see get_seg_object)
+        """
+
+        if self.seg_fb is None:
+            self.seg_fb = FrameBuffer(
+                self.obs_fb.width,
+                self.obs_fb.height,
+                num_samples=1,
+                color_format=GL_RGB8
+            )
+
+        self._draw_obs(self.seg_fb, seg=True)
+        img = self.seg_fb.resolve()
+
+        # Decode the 24-bit IDs from the RGB channels
+        seg = img.astype(np.int32)
+        seg = seg[:, :, 0:1] | (seg[:, :, 1:2] << 8) | (seg[:, :, 2:3] << 16)
+
+        return seg
+
+    def get_seg_object(self, seg_id):
+        """
+        Get the room or entity corresponding to a segmentation ID,
+        or None for the sky
+        """
+
+        if seg_id == 0:
+            return None
+
+        if seg_id <= len(self.rooms):
+            return self.rooms[seg_id - 1]
+
+        return self.entities[seg_id - len(self.rooms) - 1]
+
+    def _render_seg(self, vis_rooms=None):
+        """
+        Draw each room and entity in a flat color encoding its ID
+        The fixed-function pipeline cannot write IDs into a separate render
+        target, so this is done in its own pass. Fully dense fog replaces
+        the color of every fragment, whatever the texture, lighting and
+        vertex colors used by the regular rendering code.
+        """
+
+        state = get_gl_state()
+        state.disable(GL_LIGHTING)
+        glDisable(GL_DITHER)
+        glEnable(GL_FOG)
+        glFogi(GL_FOG_MODE, GL_LINEAR)
+        glFogf(GL_FOG_START, -1)
+        glFogf(GL_FOG_END, 0)
+
+        def set_id(seg_id):
+            color = (
+                (seg_id & 0xFF) / 255,
+                ((seg_id >> 8) & 0xFF) / 255,
+                ((seg_id >> 16) & 0xFF) / 255,
+                1
+            )
+            glFogfv(GL_FOG_COLOR, (GLfloat*4)(*color))
+
+        # Draw the rooms
+        state.disable(GL_TEXTURE_2D)
+        for room_idx in range(len(self.rooms)):
+            if vis_rooms is not None and not vis_rooms[room_idx]:
+                continue
+
+            set_id(1 + room_idx)
+            for tex, vbuf, firsts, counts in self.room_vbufs:
+                if counts[room_idx] > 0:
+                    vbuf.draw(GL_TRIANGLES, firsts[room_idx], counts[room_idx])
+
+        # IDs of the entities
+        ent_ids = {
+            ent: 1 + len(self.rooms) + ent_idx
+            for ent_idx, ent in enumerate(self.entities)
+        }
+
+        # Draw the static entities
+        ent_mask = self._get_ent_mask(self.static_ents, vis_rooms)
+        for ent_idx in np.flatnonzero(ent_mask):
+            set_id(ent_ids[self.static_ents[ent_idx]])
+            glCallList(self.static_lists + ent_idx)
+        state.invalidate(GL_TEXTURE_2D)
+
+        # Draw the non-static entities one by one
+        ents = [
+            ent for ent in self.entities
+            if not ent.is_static and ent is not self.agent
+        ]
+        ent_mask = self._get_ent_mask(ents, vis_rooms)
+        for ent in itertools.compress(ents, ent_mask):
+            set_id(ent_ids[ent])
+            ent.render()
+
+        glDisable(GL_FOG)
+        glEnable(GL_DITHER)
+        state.disable(GL_TEXTURE_2D)
+
+    def render_obs_dict(self, modalities=None):
+        """
+        Render the requested observation modalities, by default those
+        given to the constructor, into a dict. The RGB image and the
+        depth map come from the same rendering pass.
+        """
+
+        if modalities is None:
+            modalities = self.obs_modalities
+
+        obs = {}
+
+        if 'rgb' in modalities or 'depth' in modalities:
+            self._draw_obs(self.obs_fb)
+
+            if 'rgb' in modalities:
+                obs['rgb'] = self.obs_fb.resolve(self.obs_out)
+
+            if 'depth' in modalities:
+                obs['depth'] = self.obs_fb.get_depth_map(0.04, 100.0)
+
+        if 'seg' in modalities:
+            obs['seg'] = self.render_seg()
+
+        return obs
+
     def get_visible_ents(self):
         """
         Get a list of visible entities.
@@ -1276,7 +2088,7 @@ class MiniWorldEnv(gym.Env):
 
         # Switch to the default OpenGL context
         # This is necessary on Linux Nvidia drivers
-        self.shadow_window.switch_to()
+        make_current(self.shadow_window)
 
         # Use the small observation frame buffer
         frame_buffer = self.obs_fb
@@ -1285,19 +2097,17 @@ class MiniWorldEnv(gym.Env):
         frame_buffer.bind()
 
         # Clear the color and depth buffers
-        glClearColor(*self.sky_color, 1.0)
-        glClearDepth(1.0)
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        get_gl_state().clear((*self.sky_color, 1.0))
 
         # Set the projection matrix
-        glMatrixMode(GL_PROJECTION)
-        glLoadIdentity()
-        gluPerspective(
-            self.agent.cam_fov_y,
-            frame_buffer.width / float(frame_buffer.height),
-            0.04,
-            100.0
-        )
+        aspect = frame_buffer.width / float(frame_buffer.height)
+        if self._load_projection(('perspective', self.agent.cam_fov_y, aspect)):
+            gluPerspective(
+                self.agent.cam_fov_y,
+                aspect,
+                0.04,
+                100.0
+            )
 
         # Setup the cameravisible objects
         glMatrixMode(GL_MODELVIEW)
@@ -1312,9 +2122,7 @@ class MiniWorldEnv(gym.Env):
         )
 
         # Render the rooms, without texturing
-        glDisable(GL_TEXTURE_2D)
-        for room in self.rooms:
-            room._render()
+        self._render_rooms(textured=False)
 
         # For each entity
         for ent_idx, ent in enumerate(self.entities):
@@ -1350,13 +2158,37 @@ class MiniWorldEnv(gym.Env):
                 vis_objs.add(ent)
 
         # Free the occlusion query ids
-        glDeleteQueries(1, query_ids)
+        glDeleteQueries(num_ents, query_ids)
 
         #img = frame_buffer.resolve()
         #return img
 
         return vis_objs
 
+    def _init_vis(self):
+        """
+        Create the resources used for human visualization. This is only
+        done when first needed, since training never renders for humans.
+        The 800x600 float color buffer with 16x multisampling and its
+        depth buffer take about 140 MB per environment on their own
+        (123 MB of color samples and 15 MB of depth samples).
+        """
+
+        if self.vis_fb is not None:
+            return
+
+        self.vis_fb = FrameBuffer(self.window_width, self.window_height, 16)
+
+        # For displaying text
+        self.text_label = pyglet.text.Label(
+            font_name="Arial",
+            font_size=14,
+            multiline=True,
+            width=400,
+            x = self.window_width + 5,
+            y = self.window_height - (self.obs_disp_height + 19)
+        )
+
     def render(self, mode='human', close=False, view='agent'):
         """
         Render the environment for human viewing
@@ -1367,6 +2199,8 @@ class MiniWorldEnv(gym.Env):
                 self.window.close()
             return
 
+        self._init_vis()
+
         # Render the human-view image
         assert view in ['agent', 'top']
         if view == 'agent':
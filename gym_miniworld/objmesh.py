@@ -1,10 +1,14 @@
 import os
+import re
 import math
 import numpy as np
 import pyglet
 from .opengl import *
 from .utils import *
 
+# Version of the mesh cache format, bump when it changes
+MESH_CACHE_VERSION = 1
+
 class ObjMesh:
     """
     Load and render OBJ model files
@@ -13,6 +17,9 @@ class ObjMesh:
     # Loaded mesh files, indexed by mesh file path
     cache = {}
 
+    # Vertex buffer holding the vertices of all the loaded meshes
+    vbuf = None
+
     @classmethod
     def get(self, mesh_name):
         """
@@ -53,118 +60,175 @@ class ObjMesh:
 
         # Attempt to load the materials library
         materials = self._load_mtl(file_path)
-        mesh_file = open(file_path, 'r')
 
-        verts = []
-        texs = []
-        normals = []
-        faces = []
+        # Parsing is slow, so the parsed vertex data is cached
+        cache_path = self._get_cache_path(file_path)
 
-        cur_mtl = ''
+        vert_data = None
+        if cache_path:
+            vert_data, chunk_mtls, chunk_ends = self._load_cache(cache_path)
 
-        # For each line of the input file
-        for line in mesh_file:
-            line = line.rstrip(' \r\n')
+        if vert_data is None:
+            vert_data, chunk_mtls, chunk_ends = self._parse_obj(file_path, materials)
 
-            # Skip comments
-            if line.startswith('#') or line == '':
-                continue
+            if cache_path:
+                write_cache(cache_path, lambda f: np.savez(
+                    f,
+                    vert_data=vert_data,
+                    chunk_mtls=np.array(chunk_mtls, dtype=str),
+                    chunk_ends=np.array(chunk_ends, dtype=np.int64)
+                ))
 
-            tokens = line.split(' ')
-            tokens = map(lambda t: t.strip(' '), tokens)
-            tokens = list(filter(lambda t: t != '', tokens))
+        # Vertex positions, one row per triangle corner
+        list_verts = vert_data[:, 0:3].reshape(-1, 3, 3)
 
-            prefix = tokens[0]
-            tokens = tokens[1:]
+        # Compute the object extents
+        self.min_coords = list_verts.min(axis=0).min(axis=0)
+        self.max_coords = list_verts.max(axis=0).max(axis=0)
+
+        # Append the vertices to the buffer shared by all meshes
+        if ObjMesh.vbuf is None:
+            ObjMesh.vbuf = VertexBuffer()
+        first_vert = ObjMesh.vbuf.append(vert_data)
+
+        # Draw table, with the texture and range of vertices
+        # (first, count) in the shared buffer for each chunk
+        self.draw_table = []
 
-            if prefix == 'v':
-                vert = list(map(lambda v: float(v), tokens))
-                verts.append(vert)
+        # Textures, one per chunk
+        self.textures = []
 
-            if prefix == 'vt':
-                tc = list(map(lambda v: float(v), tokens))
-                texs.append(tc)
+        # Interleaved vertex data, one array per chunk
+        # Used to draw many copies of the mesh in a batch
+        self.chunk_data = []
 
-            if prefix == 'vn':
-                normal = list(map(lambda v: float(v), tokens))
-                normals.append(normal)
+        # For each chunk of faces sharing a material
+        for idx, mtl_name in enumerate(chunk_mtls):
+            start_idx = 3 * int(chunk_ends[idx-1]) if idx > 0 else 0
+            end_idx = 3 * int(chunk_ends[idx])
+
+            mtl = materials[mtl_name]
+            if 'map_Kd' in mtl:
+                texture = Texture.load(mtl['map_Kd'])
+            else:
+                texture = None
 
-            if prefix == 'usemtl':
-                mtl_name = tokens[0]
-                if mtl_name in materials:
-                    cur_mtl = mtl_name
-                else:
-                    cur_mtl = ''
+            self.draw_table.append((texture, first_vert + start_idx, end_idx - start_idx))
+            self.textures.append(texture)
+            self.chunk_data.append(vert_data[start_idx:end_idx])
 
-            if prefix == 'f':
-                assert len(tokens) == 3, "only triangle faces are supported"
+    @staticmethod
+    def _get_cache_path(file_path):
+        """
+        Get the path of the mesh cache entry for an OBJ file,
+        or None if caching is disabled
+        """
 
-                face = []
-                for token in tokens:
-                    indices = filter(lambda t: t != '', token.split('/'))
-                    indices = list(map(lambda idx: int(idx), indices))
-                    assert len(indices) == 2 or len(indices) == 3
-                    face.append(indices)
+        src_paths = [file_path]
+        mtl_path = file_path.split('.')[0] + '.mtl'
+        if os.path.exists(mtl_path):
+            src_paths.append(mtl_path)
 
-                faces.append([face, cur_mtl])
+        return get_cache_path('meshes', src_paths, 'npz', MESH_CACHE_VERSION)
 
-        # Sort the faces by material name
-        faces.sort(key=lambda f: f[1])
+    @staticmethod
+    def _load_cache(cache_path):
+        """
+        Read the parsed vertex data, chunk material names and chunk ends
+        from a mesh cache entry. Returns Nones if the entry is missing
+        or can't be read.
+        """
 
-        # Compute the start and end faces for each chunk in the model
-        cur_mtl = None
-        chunks = []
-        for idx, face in enumerate(faces):
-            face, mtl_name = face
-            if mtl_name != cur_mtl:
-                if len(chunks) > 0:
-                    chunks[-1]['end_idx'] = idx
-                chunks.append({
-                    'mtl': materials[mtl_name],
-                    'start_idx': idx,
-                    'end_idx': None
-                })
-                cur_mtl = mtl_name
-        chunks[-1]['end_idx'] = len(faces)
-
-        num_faces = len(faces)
-        #print('num verts=%d' % len(verts))
-        #print('num faces=%d' % num_faces)
-        #print('num chunks=%d' % len(chunks))
-
-        # Create numpy arrays to store the vertex data
-        list_verts = np.zeros(shape=(num_faces, 3, 3), dtype=np.float32)
-        list_norms = np.zeros(shape=(num_faces, 3, 3), dtype=np.float32)
-        list_texcs = np.zeros(shape=(num_faces, 3, 2), dtype=np.float32)
-        list_color = np.zeros(shape=(num_faces, 3, 3), dtype=np.float32)
+        if not os.path.exists(cache_path):
+            return None, None, None
+
+        try:
+            with np.load(cache_path) as cached:
+                return (
+                    cached['vert_data'],
+                    list(cached['chunk_mtls']),
+                    list(cached['chunk_ends'])
+                )
+        except (OSError, ValueError, KeyError):
+            return None, None, None
+
+    @staticmethod
+    def _parse_obj(file_path, materials):
+        """
+        Parse an OBJ file into interleaved vertex data (see interleave_verts),
+        with three vertices per face and the faces sorted by material name.
+        Also returns the material name of each chunk of faces and the
+        index of the face ending each chunk.
+
+        The file is split into sections by usemtl statements, and each
+        type of statement is extracted with a regular expression and
+        converted with numpy in one go, rather than line by line.
+        """
+
+        with open(file_path, 'r') as mesh_file:
+            text = mesh_file.read()
+
+        def parse_floats(prefix, num_vals):
+            lines = re.findall(r'^%s[ \t]+(.*)$' % prefix, text, re.M)
+            vals = np.array(' '.join(lines).split(), dtype=np.float64)
+            if len(lines) == 0:
+                return vals.reshape(0, num_vals)
+            return vals.reshape(len(lines), -1)[:, :num_vals]
+
+        verts = parse_floats('v', 3)
+        texs = parse_floats('vt', 2)
+        normals = parse_floats('vn', 3)
+
+        # Faces before any usemtl statement use the default material
+        sections = re.split(r'^usemtl[ \t]+(\S*).*$', text, flags=re.M)
+        section_mtls = [''] + sections[1::2]
+        section_texts = sections[0::2]
+
+        mtl_faces = {}
+        for mtl_name, section in zip(section_mtls, section_texts):
+            if mtl_name not in materials:
+                mtl_name = ''
+
+            lines = re.findall(r'^f[ \t]+(.*)$', section, re.M)
+            if len(lines) == 0:
+                continue
 
-        # For each triangle
-        for f_idx, face in enumerate(faces):
-            face, mtl_name = face
+            # Faces are lists of v/t/n or v//n index tuples
+            indices = ' '.join(lines).replace('//', '/0/').replace('/', ' ')
+            indices = np.array(indices.split(), dtype=np.int64)
+            assert indices.shape[0] == 9 * len(lines), \
+                "only triangle faces are supported"
 
-            # Get the color for this face
+            mtl_faces.setdefault(mtl_name, []).append(indices.reshape(-1, 3, 3))
+
+        assert len(mtl_faces) > 0, 'no faces in "%s"' % file_path
+
+        chunk_mtls = sorted(mtl_faces)
+        chunk_faces = [np.concatenate(mtl_faces[m]) for m in chunk_mtls]
+        chunk_ends = list(np.cumsum([len(f) for f in chunk_faces]))
+        faces = np.concatenate(chunk_faces)
+        num_faces = faces.shape[0]
+
+        # Note: OBJ uses 1-based indexing
+        # and texture coordinates are optional
+        v_idx = faces[:, :, 0] - 1
+        t_idx = faces[:, :, 1] - 1
+        n_idx = faces[:, :, 2] - 1
+
+        list_verts = verts[v_idx].astype(np.float32)
+        list_norms = normals[n_idx].astype(np.float32)
+        list_texcs = np.zeros(shape=(num_faces, 3, 2), dtype=np.float32)
+        if texs.shape[0] > 0:
+            has_tex = t_idx >= 0
+            list_texcs[has_tex] = texs[t_idx[has_tex]]
+
+        # Get the color for each face
+        list_color = np.zeros(shape=(num_faces, 3, 3), dtype=np.float32)
+        for idx, mtl_name in enumerate(chunk_mtls):
             f_mtl = materials[mtl_name]
             f_color = f_mtl['Kd'] if f_mtl else np.array((1,1,1))
-
-            # For each tuple of indices
-            for l_idx, indices in enumerate(face):
-                # Note: OBJ uses 1-based indexing
-                # and texture coordinates are optional
-                if len(indices) == 3:
-                    v_idx, t_idx, n_idx = indices
-                    vert = verts[v_idx-1]
-                    texc = texs[t_idx-1]
-                    normal = normals[n_idx-1]
-                else:
-                    v_idx, n_idx = indices
-                    vert = verts[v_idx-1]
-                    normal = normals[n_idx-1]
-                    texc = [0, 0]
-
-                list_verts[f_idx, l_idx, :] = vert
-                list_texcs[f_idx, l_idx, :] = texc
-                list_norms[f_idx, l_idx, :] = normal
-                list_color[f_idx, l_idx, :] = f_color
+            start_idx = chunk_ends[idx-1] if idx > 0 else 0
+            list_color[start_idx:chunk_ends[idx]] = f_color
 
         # Re-center the object so that the base is at y=0
         # and the object is centered in x and z
@@ -178,39 +242,14 @@ class ObjMesh:
         list_verts[:, :, 0] -= mean_x
         list_verts[:, :, 2] -= mean_z
 
-        # Recompute the object extents after centering
-        self.min_coords = list_verts.min(axis=0).min(axis=0)
-        self.max_coords = list_verts.max(axis=0).max(axis=0)
-
-        # Vertex lists, one per chunk
-        self.vlists = []
-
-        # Textures, one per chunk
-        self.textures = []
-
-        # For each chunk
-        for chunk in chunks:
-            start_idx = chunk['start_idx']
-            end_idx = chunk['end_idx']
-            num_faces_chunk = end_idx - start_idx
-
-            # Create a vertex list to be used for rendering
-            vlist = pyglet.graphics.vertex_list(
-                3 * num_faces_chunk,
-                ('v3f', list_verts[start_idx:end_idx, :, :].reshape(-1)),
-                ('t2f', list_texcs[start_idx:end_idx, :, :].reshape(-1)),
-                ('n3f', list_norms[start_idx:end_idx, :, :].reshape(-1)),
-                ('c3f', list_color[start_idx:end_idx, :, :].reshape(-1))
-            )
-
-            mtl = chunk['mtl']
-            if 'map_Kd' in mtl:
-                texture = Texture.load(mtl['map_Kd'])
-            else:
-                texture = None
+        vert_data = interleave_verts(
+            list_verts.reshape(-1, 3),
+            list_norms.reshape(-1, 3),
+            list_texcs.reshape(-1, 2),
+            list_color.reshape(-1, 3)
+        )
 
-            self.vlists.append(vlist)
-            self.textures.append(texture)
+        return vert_data, chunk_mtls, chunk_ends
 
     def _load_mtl(self, model_file):
         model_dir, file_name = os.path.split(model_file)
@@ -277,15 +316,7 @@ class ObjMesh:
         return materials
 
     def render(self):
-        for idx, vlist in enumerate(self.vlists):
-            texture = self.textures[idx]
-
-            if texture:
-                glEnable(GL_TEXTURE_2D)
-                glBindTexture(texture.target, texture.id)
-            else:
-                glDisable(GL_TEXTURE_2D)
-
-            vlist.draw(GL_TRIANGLES)
-
-        glDisable(GL_TEXTURE_2D)
+        draw_ranges(
+            (ObjMesh.vbuf, texture, first, count)
+            for texture, first, count in self.draw_table
+        )
@@ -1,13 +1,40 @@
 import math
 import os
+import sys
+from collections import deque
 import numpy as np
 import pyglet
 
-# Solution to https://github.com/maximecb/gym-miniworld/issues/24
-# until pyglet support egl officially
-if os.environ.get('PYOPENGL_PLATFORM', None) == 'egl':
+def _use_headless():
+    """
+    Decide if rendering should go through a headless EGL context
+    instead of an (invisible) X11 window
+
+    MINIWORLD_HEADLESS=1 forces the EGL backend, MINIWORLD_HEADLESS=0
+    forces the windowed backend. Otherwise, EGL is used when requested
+    through PYOPENGL_PLATFORM, or when there is no X display to connect to.
+    """
+
+    forced = os.environ.get('MINIWORLD_HEADLESS', None)
+    if forced is not None:
+        return forced == '1'
+
+    # Solution to https://github.com/maximecb/gym-miniworld/issues/24
+    if os.environ.get('PYOPENGL_PLATFORM', None) == 'egl':
+        return True
+
+    # Pyglet can only open a window on Linux if an X server is available
+    return sys.platform.startswith('linux') and not os.environ.get('DISPLAY')
+
+if _use_headless():
     pyglet.options['headless'] = True
 
+# Pyglet checks for OpenGL errors after every call by default, which
+# costs more than many of the calls themselves. MINIWORLD_DEBUG_GL=0
+# turns the checks off, at the cost of OpenGL errors going unnoticed.
+if os.environ.get('MINIWORLD_DEBUG_GL', None) == '0':
+    pyglet.options['debug_gl'] = False
+
 from pyglet.gl import *
 from ctypes import byref, POINTER
 from .utils import *
@@ -25,84 +52,558 @@ FB_ERROR_ENUMS = {
     GL_FRAMEBUFFER_INCOMPLETE_LAYER_TARGETS: 'GL_FRAMEBUFFER_INCOMPLETE_LAYER_TARGETS',
 }
 
+# Number of OpenGL calls made while call counting is enabled
+_gl_call_count = 0
+
+# Original error checking hooks of the OpenGL functions,
+# while call counting is enabled
+_gl_errchecks = None
+
+def _counting_errcheck(errcheck):
+    """
+    Wrap the error checking hook of an OpenGL function, which ctypes
+    runs after every call, to count the calls
+    """
+
+    def check(result, func, args):
+        global _gl_call_count
+        _gl_call_count += 1
+        if errcheck is None:
+            return result
+        return errcheck(result, func, args)
+
+    return check
+
+def enable_gl_call_count(enabled=True):
+    """
+    Start or stop counting the OpenGL calls made through pyglet, in all
+    modules. Counting adds a little overhead to every call, and so is
+    disabled by default. See get_gl_call_count.
+    """
+
+    global _gl_errchecks
+
+    if enabled and _gl_errchecks is None:
+        # Some functions are exported under several names
+        # The glGetError calls made by pyglet's error checking after
+        # every call (see debug_gl) are not counted
+        _gl_errchecks = {}
+        for func in vars(pyglet.gl).values():
+            if isinstance(func, type) or not hasattr(func, 'errcheck'):
+                continue
+            if func is pyglet.gl.glGetError:
+                continue
+            if id(func) in _gl_errchecks:
+                continue
+            _gl_errchecks[id(func)] = (func, func.errcheck)
+            func.errcheck = _counting_errcheck(func.errcheck)
+
+    elif not enabled and _gl_errchecks is not None:
+        for func, errcheck in _gl_errchecks.values():
+            if errcheck is None:
+                del func.errcheck
+            else:
+                func.errcheck = errcheck
+        _gl_errchecks = None
+
+def get_gl_call_count(reset=False):
+    """
+    Get the number of OpenGL calls made since call counting was enabled,
+    or since the count was last reset
+    """
+
+    global _gl_call_count
+
+    count = _gl_call_count
+    if reset:
+        _gl_call_count = 0
+
+    return count
+
+# Invisible window owning the OpenGL context used for offscreen rendering
+# This context is shared by all environments living in the same process
+_shadow_window = None
+
+def get_shadow_window():
+    """
+    Get the invisible window used for offscreen rendering. This is the
+    shadow window pyglet creates when it is imported, unless it was
+    disabled through pyglet.options['shadow_window'], in which case
+    a window is created the first time this is called.
+    """
+
+    global _shadow_window
+
+    if _shadow_window is None:
+        _shadow_window = pyglet.gl._shadow_window
+
+    if _shadow_window is None:
+        _shadow_window = pyglet.window.Window(width=1, height=1, visible=False)
+
+    return _shadow_window
+
+def make_current(window):
+    """
+    Make the OpenGL context of a window current.
+    Switching contexts is expensive, so this is a no-op
+    when the context is already current.
+    """
+
+    if pyglet.gl.current_context is not window.context:
+        window.switch_to()
+
+def get_backend_name():
+    """
+    Describe the OpenGL backend and renderer in use
+    """
+
+    backend = 'EGL (headless)' if pyglet.options['headless'] else 'windowed'
+    return '{}, {}'.format(backend, gl_info.get_renderer())
+
+class GLState:
+    """
+    Shadow copy of a part of the state of an OpenGL context, used to skip
+    the calls which would leave it unchanged. Only the changes made through
+    this class are tracked: code changing the same state directly, such as
+    display lists enabling texturing, must call invalidate() afterwards.
+    While a display list is being compiled, calls are recorded into the
+    list rather than executed, so they are always made and never tracked.
+    """
+
+    # Incremented whenever a vertex buffer is deleted, as its name can
+    # then be reused by a new buffer, which must be set up again
+    buffer_generation = 0
+
+    def __init__(self):
+        # Capabilities known to be enabled or disabled
+        self.caps = {}
+
+        self.clear_color = None
+        self.clear_depth = None
+        self.viewport = None
+        self.scissor = None
+
+        # Key of the projection matrix currently loaded (see set_projection)
+        self.projection = None
+
+        # Light parameters, by (light, parameter name)
+        self.lights = {}
+
+        # Vertex buffer the vertex array pointers are set up for,
+        # as a (buffer name, generation) pair
+        self.vertex_buffer = None
+
+        # Set while compiling a display list
+        self.compiling = False
+
+    def enable(self, cap):
+        if self.compiling:
+            glEnable(cap)
+        elif self.caps.get(cap) is not True:
+            glEnable(cap)
+            self.caps[cap] = True
+
+    def disable(self, cap):
+        if self.compiling:
+            glDisable(cap)
+        elif self.caps.get(cap) is not False:
+            glDisable(cap)
+            self.caps[cap] = False
+
+    def invalidate(self, cap=None):
+        """
+        Forget the state of a capability, or of all of them
+        """
+
+        if cap is None:
+            self.caps.clear()
+        else:
+            self.caps.pop(cap, None)
+
+    def new_list(self, list_id):
+        glNewList(list_id, GL_COMPILE)
+        self.compiling = True
+
+    def end_list(self):
+        glEndList()
+        self.compiling = False
+
+    def set_viewport(self, x, y, width, height):
+        viewport = (x, y, width, height)
+        if viewport != self.viewport:
+            glViewport(x, y, width, height)
+            self.viewport = viewport
+
+    def set_scissor(self, x, y, width, height):
+        scissor = (x, y, width, height)
+        if scissor != self.scissor:
+            glScissor(x, y, width, height)
+            self.scissor = scissor
+
+    def clear(self, color, depth=1.0):
+        """
+        Clear the color and depth buffers, with color an RGBA tuple
+        """
+
+        color = tuple(color)
+        if color != self.clear_color:
+            glClearColor(*color)
+            self.clear_color = color
+        if depth != self.clear_depth:
+            glClearDepth(depth)
+            self.clear_depth = depth
+
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+
+    def set_light(self, light, pname, values):
+        """
+        Set a parameter of a light, such as its ambient or diffuse color,
+        from a list of up to 4 values (the missing ones are zero).
+        The light position must be set directly, since it is transformed
+        by the modelview matrix in effect at the time it is set.
+        """
+
+        values = tuple(values)
+        if self.lights.get((light, pname)) != values:
+            glLightfv(light, pname, (GLfloat*4)(*values))
+            self.lights[(light, pname)] = values
+
+    def set_projection(self, key):
+        """
+        Record the key (eg: field of view and aspect ratio) of the
+        projection matrix about to be loaded. Returns False if the
+        same projection matrix is already loaded, in which case it
+        does not need to be loaded again.
+        """
+
+        if key == self.projection:
+            return False
+
+        self.projection = key
+        return True
+
+    def bind_vertex_buffer(self, vbuf):
+        """
+        Set up the vertex array pointers for a vertex buffer. The vertex
+        arrays are left enabled afterwards, until release_vertex_arrays()
+        is called, so that drawing from the same buffer again is free.
+        """
+
+        key = (vbuf.vbo.value, GLState.buffer_generation)
+        if key == self.vertex_buffer:
+            return
+
+        if self.vertex_buffer is None:
+            glEnableClientState(GL_VERTEX_ARRAY)
+            glEnableClientState(GL_NORMAL_ARRAY)
+            glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+            glEnableClientState(GL_COLOR_ARRAY)
+
+        stride = vbuf.VERTEX_SIZE * 4
+        glBindBuffer(GL_ARRAY_BUFFER, vbuf.vbo)
+        glVertexPointer(3, GL_FLOAT, stride, 0)
+        glNormalPointer(GL_FLOAT, stride, vbuf.NORMAL_OFS * 4)
+        glTexCoordPointer(2, GL_FLOAT, stride, vbuf.TEXC_OFS * 4)
+        glColorPointer(3, GL_FLOAT, stride, vbuf.COLOR_OFS * 4)
+
+        self.vertex_buffer = key
+
+    def release_vertex_arrays(self):
+        """
+        Disable the vertex arrays and unbind the vertex buffer, which must
+        be done before drawing with pyglet or with client-side vertex arrays
+        """
+
+        if self.vertex_buffer is not None:
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+            glDisableClientState(GL_VERTEX_ARRAY)
+            glDisableClientState(GL_NORMAL_ARRAY)
+            glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+            glDisableClientState(GL_COLOR_ARRAY)
+            self.vertex_buffer = None
+
+def get_gl_state():
+    """
+    Get the tracked state of the current OpenGL context
+    """
+
+    context = pyglet.gl.current_context
+    state = getattr(context, 'miniworld_state', None)
+
+    if state is None:
+        state = GLState()
+        context.miniworld_state = state
+
+    return state
+
+# Version of the decoded texture cache format, bump when it changes
+TEX_CACHE_VERSION = 1
+
+def downsample_image(img, width, height):
+    """
+    Resize an (H, W, 3) uint8 image to the given size with bilinear
+    filtering. When halving the size, this is a 2x2 box filter, which
+    closely matches the mipmaps generated by the GL.
+    """
+
+    def resample(img, axis, dst_size):
+        src_size = img.shape[axis]
+        pos = (np.arange(dst_size) + 0.5) * (src_size / dst_size) - 0.5
+        pos = np.clip(pos, 0, src_size - 1)
+        idx0 = np.floor(pos).astype(np.int64)
+        idx1 = np.minimum(idx0 + 1, src_size - 1)
+        shape = [1, 1, 1]
+        shape[axis] = dst_size
+        frac = (pos - idx0).astype(np.float32).reshape(shape)
+        a = np.take(img, idx0, axis=axis).astype(np.float32)
+        b = np.take(img, idx1, axis=axis).astype(np.float32)
+        return np.floor(a + (b - a) * frac + 0.5).astype(np.uint8)
+
+    # Filter one axis at a time, rounding after each pass
+    img = resample(img, 0, height)
+    img = resample(img, 1, width)
+
+    return img
+
+def gen_mipmaps(img):
+    """
+    Generate the full chain of mipmap levels for an (H, W, 3) image,
+    down to a 1x1 texel level
+    """
+
+    levels = [img]
+
+    while img.shape[0] > 1 or img.shape[1] > 1:
+        height = max(1, img.shape[0] // 2)
+        width = max(1, img.shape[1] // 2)
+        img = downsample_image(img, width, height)
+        levels.append(img)
+
+    return levels
+
+def _split_mipmaps(data):
+    """
+    Split a flat array of mipmap data, as stored in the texture cache,
+    into a list of (H, W, 3) levels. The first 8 bytes of the array
+    hold the width and height of the base level.
+    """
+
+    width, height = (int(v) for v in data[:8].view('<u4'))
+
+    levels = []
+    offset = 8
+    while True:
+        size = height * width * 3
+        levels.append(data[offset:offset+size].reshape(height, width, 3))
+        offset += size
+        if height == 1 and width == 1:
+            break
+        height = max(1, height // 2)
+        width = max(1, width // 2)
+
+    assert offset == data.shape[0], "corrupted texture cache entry"
+
+    return levels
+
+def load_mipmaps(tex_path):
+    """
+    Get the mipmap levels of a texture image, with the rows ordered
+    bottom to top as expected by the GL.
+
+    Decoding PNG files is slow, so the decoded levels are stored in the
+    cache directory (see get_cache_path), keyed by the path, size and
+    modification time of the image file. Cached levels are memory-mapped
+    rather than read.
+    """
+
+    cache_path = get_cache_path('textures', [tex_path], 'npy', TEX_CACHE_VERSION)
+
+    if cache_path and os.path.exists(cache_path):
+        try:
+            return _split_mipmaps(np.load(cache_path, mmap_mode='r'))
+        except (OSError, ValueError, AssertionError):
+            pass
+
+    img = pyglet.image.load(tex_path)
+    data = img.get_image_data().get_data('RGB', img.width * 3)
+    img = np.frombuffer(data, dtype=np.uint8).reshape(img.height, img.width, 3)
+    levels = gen_mipmaps(img)
+
+    if cache_path:
+        header = np.array([img.shape[1], img.shape[0]], dtype='<u4')
+        data = np.concatenate(
+            [header.view(np.uint8)] + [level.reshape(-1) for level in levels]
+        )
+        write_cache(cache_path, lambda f: np.save(f, data))
+
+    return levels
+
 class Texture:
     """
     Manage the loading and caching of textures, as well as texture randomization
     """
 
-    # List of textures available for a given path
+    # List of texture files available for a given name (see get_paths)
     tex_paths = {}
 
+    # Texture files by name (path relative to the textures directory,
+    # without extension), and names with their numbered variants
+    # (eg: brick_wall_1, brick_wall_2) indexed under the common prefix
+    tex_files = None
+    tex_variants = None
+
     # Cache of textures
     tex_cache = {}
 
     @classmethod
-    def get(self, tex_name, rng=None):
+    def _index_files(self):
         """
-        Load a texture by name (or used a cached version)
-        Also performs domain randomization if multiple versions are available.
+        Scan the textures directory once, to index the available files
         """
 
-        paths = self.tex_paths.get(tex_name, [])
-        # print(f'!!! tex_name: {tex_name}, paths: {paths}')
+        tex_dir = get_subdir_path('textures')
+        self.tex_files = {}
+        variants = {}
 
-        if tex_name[-1].isdigit():
-            path = get_file_path('textures', '%s' % (tex_name), 'png')
-            paths.append(path)
+        for dir_path, _, file_names in os.walk(tex_dir):
+            for file_name in file_names:
+                name, ext = os.path.splitext(file_name)
+                if ext != '.png':
+                    continue
+
+                path = os.path.join(dir_path, file_name)
+                name = os.path.relpath(os.path.join(dir_path, name), tex_dir)
+                name = name.replace(os.sep, '/')
+                self.tex_files[name] = path
+
+                prefix, _, idx = name.rpartition('_')
+                if prefix and idx.isdigit():
+                    variants.setdefault(prefix, []).append((int(idx), path))
+
+        self.tex_variants = {
+            prefix: [path for _, path in sorted(paths)]
+            for prefix, paths in variants.items()
+        }
 
+    @classmethod
+    def get_paths(self, tex_name):
+        """
+        Get the list of texture files available for a given name
+        A name ending with a digit refers to a specific file if it exists,
+        other names refer to their numbered variants if there are any.
+        """
+
+        paths = self.tex_paths.get(tex_name, None)
+        if paths is not None:
+            return paths
+
+        if self.tex_files is None:
+            self._index_files()
+
+        exact = [self.tex_files[tex_name]] if tex_name in self.tex_files else []
+        variants = self.tex_variants.get(tex_name, [])
+
+        if tex_name[-1].isdigit():
+            paths = exact or variants
         else:
-            # Get an inventory of the existing texture files
-            if len(paths) == 0:
-                for i in range(1, 10):
-                    path = get_file_path('textures', '%s_%d' % (tex_name, i), 'png')
+            paths = variants or exact
 
-                    if not os.path.exists(path):
-                        break
-                    paths.append(path)
+        # Names outside of the textures directory (eg: absolute paths)
+        if len(paths) == 0:
+            path = get_file_path('textures', tex_name, 'png')
+            if os.path.exists(path):
+                paths = [path]
 
         assert len(paths) > 0, 'failed to load textures for name "%s"' % tex_name
 
+        self.tex_paths[tex_name] = paths
+
+        return paths
+
+    @classmethod
+    def get_path(self, tex_name, rng=None):
+        """
+        Get the path of the texture file to use for a given name
+        Also performs domain randomization if multiple versions are available.
+        """
+
+        paths = self.get_paths(tex_name)
+
         # If domain-randomization is to be used
         if rng:
             path_idx = rng.int(0, len(paths))
-            path = paths[path_idx]
-        else:
-            path = paths[0]
+            return paths[path_idx]
+
+        return paths[0]
+
+    @classmethod
+    def get(self, tex_name, rng=None, max_size=None):
+        """
+        Load a texture by name (or used a cached version)
+        Also performs domain randomization if multiple versions are available.
+        The max_size argument limits the resolution of the texture (see load).
+        """
+
+        path = self.get_path(tex_name, rng)
 
-        if path not in self.tex_cache:
-            self.tex_cache[path] = Texture(Texture.load(path), tex_name)
+        key = (path, max_size)
+        if key not in self.tex_cache:
+            self.tex_cache[key] = Texture(Texture.load(path, max_size), tex_name)
 
-        return self.tex_cache[path]
+        return self.tex_cache[key]
 
     @classmethod
-    def load(cls, tex_path):
+    def load(cls, tex_path, max_size=None):
         """
         Load a texture based on its path. No domain randomization.
         In mose cases, this method should not be used directly.
+
+        If max_size is given, the levels of detail larger than max_size
+        texels are skipped. The texture keeps the size of the source image,
+        since texture coordinates are derived from it (see gen_texcs_wall).
         """
 
         #print('Loading texture "%s"' % tex_path)
 
-        img = pyglet.image.load(tex_path)
-        tex = img.get_texture()
-        glEnable(tex.target)
-        glBindTexture(tex.target, tex.id)
+        levels = load_mipmaps(tex_path)
+        height, width, _ = levels[0].shape
 
-        glTexImage2D(
-            GL_TEXTURE_2D,
-            0,
-            GL_RGB,
-            img.width,
-            img.height,
-            0,
-            GL_RGBA,
-            GL_UNSIGNED_BYTE,
-            img.get_image_data().get_data('RGBA', img.width * 4)
-        )
+        if max_size is not None:
+            while len(levels) > 1 and max(levels[0].shape[:2]) > max_size:
+                levels = levels[1:]
+
+        return cls.upload(levels, width, height)
+
+    @classmethod
+    def upload(cls, levels, width=None, height=None):
+        """
+        Create a texture from a list of mipmap levels (see gen_mipmaps)
+        By default, the size of the texture is that of the first level.
+        """
+
+        if width is None:
+            height, width, _ = levels[0].shape
 
-        # Generate mipmaps (multiple levels of detail)
-        glHint(GL_GENERATE_MIPMAP_HINT, GL_NICEST)
-        glGenerateMipmap(GL_TEXTURE_2D)
+        tex_id = GLuint(0)
+        glGenTextures(1, byref(tex_id))
+        tex = pyglet.image.Texture(width, height, GL_TEXTURE_2D, tex_id.value)
+        glBindTexture(tex.target, tex.id)
+
+        # Upload the precomputed levels of detail, rows are tightly packed
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        for level, data in enumerate(levels):
+            glTexImage2D(
+                GL_TEXTURE_2D,
+                level,
+                GL_RGB,
+                data.shape[1],
+                data.shape[0],
+                0,
+                GL_RGB,
+                GL_UNSIGNED_BYTE,
+                data.ctypes.data
+            )
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
 
         # Trilinear texture filtering
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
@@ -123,13 +624,81 @@ class Texture:
     def bind(self):
         glBindTexture(self.tex.target, self.tex.id)
 
+    def delete(self):
+        """
+        Release the OpenGL texture
+        """
+
+        # Zero the name, so pyglet doesn't delete it again (possibly
+        # after it was reused by another texture) when collected
+        if self.tex.id != 0:
+            glDeleteTextures(1, byref(GLuint(self.tex.id)))
+            self.tex.id = 0
+
+# Frame buffer format/quality profiles
+# Each profile is a set of keyword arguments for the FrameBuffer constructor
+FB_PROFILES = {
+    # Float color buffer with 8x multisampling (original settings)
+    'quality': {
+        'num_samples': 8,
+        'color_format': GL_RGBA32F,
+    },
+
+    # 8-bit color buffer with 4x multisampling
+    'balanced': {
+        'num_samples': 4,
+        'color_format': GL_RGBA8,
+    },
+
+    # 8-bit color buffer without multisampling,
+    # rendered into directly, with no resolve step
+    'fast': {
+        'num_samples': 1,
+        'color_format': GL_RGB8,
+    },
+}
+
+def get_fb_profile(profile):
+    """
+    Get the FrameBuffer arguments (num_samples, color_format) for a
+    profile, given either as a key of FB_PROFILES or as a dict
+    """
+
+    if isinstance(profile, str):
+        assert profile in FB_PROFILES, profile
+        profile = FB_PROFILES[profile]
+
+    return profile
+
+def get_max_fb_size():
+    """
+    Get the maximum width and height of the frame buffers
+    supported by the OpenGL driver
+    """
+
+    max_size = None
+
+    for param in (GL_MAX_TEXTURE_SIZE, GL_MAX_RENDERBUFFER_SIZE):
+        size = GLint(0)
+        glGetIntegerv(param, byref(size))
+        if max_size is None or size.value < max_size:
+            max_size = size.value
+
+    return max_size
+
 class FrameBuffer:
     """
     Manage frame buffers for rendering
     """
 
-    def __init__(self, width, height, num_samples=1):
-        """Create the frame buffer objects"""
+    def __init__(self, width, height, num_samples=1, color_format=GL_RGBA32F, num_pbos=2):
+        """
+        Create the frame buffer objects
+        When num_samples is 1, multisampling is disabled and rendering
+        goes directly into the final frame buffer
+        num_pbos is the size of the ring of pixel buffer objects used
+        for asynchronous readback (allocated on first use of read_async)
+        """
 
         assert num_samples > 0
         assert num_samples <= 16
@@ -137,13 +706,94 @@ class FrameBuffer:
         self.width = width
         self.height = height
 
-        # Create a frame buffer (rendering target)
+        # Textures and render buffers attached to the frame buffers,
+        # released by delete()
+        self.textures = []
+        self.renderbuffers = []
+
+        # Create a multisampled frame buffer (rendering target)
+        self.multi_fbo = None
+        if num_samples > 1:
+            num_samples = self._create_multi_fbo(num_samples, color_format)
+
+        self.num_samples = num_samples
+
+        # Create the frame buffer used to resolve the final render
+        self.final_fbo = GLuint(0)
+        glGenFramebuffers(1, byref(self.final_fbo))
+        glBindFramebuffer(GL_FRAMEBUFFER, self.final_fbo)
+
+        # Create the texture used to resolve the final render
+        # When not multisampling, this is what we render into
+        fbTex = GLuint(0)
+        glGenTextures(1, byref(fbTex))
+        self.textures.append(fbTex)
+        glBindTexture(GL_TEXTURE_2D, fbTex)
+        glTexImage2D(
+            GL_TEXTURE_2D,
+            0,
+            GL_RGBA if self.multi_fbo else color_format,
+            width,
+            height,
+            0,
+            GL_RGBA,
+            GL_FLOAT,
+            None
+        )
+        glFramebufferTexture2D(
+            GL_FRAMEBUFFER,
+            GL_COLOR_ATTACHMENT0,
+            GL_TEXTURE_2D,
+            fbTex,
+            0
+        )
+
+        # Create a depth buffer for the final frame buffer
+        depth_rb = GLuint(0)
+        glGenRenderbuffers(1, byref(depth_rb))
+        self.renderbuffers.append(depth_rb)
+        glBindRenderbuffer(GL_RENDERBUFFER, depth_rb)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT16, width, height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, depth_rb)
+
+        # Sanity check
+        res = glCheckFramebufferStatus(GL_FRAMEBUFFER)
+        assert res == GL_FRAMEBUFFER_COMPLETE, FB_ERROR_ENUMS.get(res, res)
+
+        # Without multisampling, render directly into the final frame buffer
+        if self.multi_fbo is None:
+            self.multi_fbo = self.final_fbo
+
+        # Enable depth testing
+        glEnable(GL_DEPTH_TEST)
+
+        # Unbind the frame buffer
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+        # Shape of the RGB images read back from this frame buffer
+        self.img_shape = (height, width, 3)
+        self.img_nbytes = height * width * 3
+
+        # Ring of pixel buffer objects for asynchronous readback
+        assert num_pbos >= 2
+        self.num_pbos = num_pbos
+        self.pbos = None
+        self.next_pbo = 0
+
+        # Pixel buffer objects with a readback in flight, oldest first
+        self.pending_pbos = deque()
+
+    def _create_multi_fbo(self, num_samples, color_format):
+        """
+        Create the multisampled frame buffer
+        Returns the number of samples actually used, which is
+        1 if multisampling is not supported
+        """
+
         self.multi_fbo = GLuint(0)
         glGenFramebuffers(1, byref(self.multi_fbo))
         glBindFramebuffer(GL_FRAMEBUFFER, self.multi_fbo)
-        
 
-        # num_samples = 1
         # The try block here is because some OpenGL drivers
         # (Intel GPU drivers on MacBooks in particular) do not
         # support multisampling on frame buffer objects
@@ -164,13 +814,14 @@ class FrameBuffer:
             # Create a multisampled texture to render into
             fbTex = GLuint(0)
             glGenTextures( 1, byref(fbTex))
+            self.textures.append(fbTex)
             glBindTexture(GL_TEXTURE_2D_MULTISAMPLE, fbTex)
             glTexImage2DMultisample(
                 GL_TEXTURE_2D_MULTISAMPLE,
                 num_samples,
-                GL_RGBA32F,
-                width,
-                height,
+                color_format,
+                self.width,
+                self.height,
                 True
             )
             glFramebufferTexture2D(
@@ -184,8 +835,9 @@ class FrameBuffer:
             # Attach a multisampled depth buffer to the FBO
             depth_rb = GLuint(0)
             glGenRenderbuffers(1, byref(depth_rb))
+            self.renderbuffers.append(depth_rb)
             glBindRenderbuffer(GL_RENDERBUFFER, depth_rb)
-            glRenderbufferStorageMultisample(GL_RENDERBUFFER, num_samples, GL_DEPTH_COMPONENT16, width, height)
+            glRenderbufferStorageMultisample(GL_RENDERBUFFER, num_samples, GL_DEPTH_COMPONENT16, self.width, self.height)
             glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, depth_rb)
 
             # Check that the frame buffer creation succeeded
@@ -194,89 +846,39 @@ class FrameBuffer:
 
         except:
             print('Falling back to non-multisampled frame buffer')
+            glBindFramebuffer(GL_FRAMEBUFFER, 0)
+            glDeleteFramebuffers(1, byref(self.multi_fbo))
+            self.multi_fbo = None
+            return 1
 
-            # Create a plain texture texture to render into
-            fbTex = GLuint(0)
-            glGenTextures( 1, byref(fbTex))
-            glBindTexture(GL_TEXTURE_2D, fbTex)
-            glTexImage2D(
-                GL_TEXTURE_2D,
-                0,
-                GL_RGBA,
-                width,
-                height,
-                0,
-                GL_RGBA,
-                GL_FLOAT,
-                None
-            )
-            glFramebufferTexture2D(
-                GL_FRAMEBUFFER,
-                GL_COLOR_ATTACHMENT0,
-                GL_TEXTURE_2D,
-                fbTex,
-                0
-            )
-
-            # Attach depth buffer to FBO
-            depth_rb = GLuint(0)
-            glGenRenderbuffers(1, byref(depth_rb))
-            glBindRenderbuffer(GL_RENDERBUFFER, depth_rb)
-            glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT16, width, height)
-            glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, depth_rb)
-
-        # Sanity check
-        res = glCheckFramebufferStatus(GL_FRAMEBUFFER)
-        assert res == GL_FRAMEBUFFER_COMPLETE, FB_ERROR_ENUMS.get(res, res)
-
-        # Create the frame buffer used to resolve the final render
-        self.final_fbo = GLuint(0)
-        glGenFramebuffers(1, byref(self.final_fbo))
-        glBindFramebuffer(GL_FRAMEBUFFER, self.final_fbo)
+        return num_samples
 
-        # Create the texture used to resolve the final render
-        fbTex = GLuint(0)
-        glGenTextures(1, byref(fbTex))
-        glBindTexture(GL_TEXTURE_2D, fbTex)
-        glTexImage2D(
-            GL_TEXTURE_2D,
-            0,
-            GL_RGBA,
-            width,
-            height,
-            0,
-            GL_RGBA,
-            GL_FLOAT,
-            None
-        )
-        glFramebufferTexture2D(
-            GL_FRAMEBUFFER,
-            GL_COLOR_ATTACHMENT0,
-            GL_TEXTURE_2D,
-            fbTex,
-            0
-        )
+    def delete(self):
+        """
+        Release the OpenGL objects owned by this frame buffer
+        """
 
-        # Create a depth buffer for the final frame buffer
-        depth_rb = GLuint(0)
-        glGenRenderbuffers(1, byref(depth_rb))
-        glBindRenderbuffer(GL_RENDERBUFFER, depth_rb)
-        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT16, width, height)
-        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, depth_rb)
+        if self.final_fbo is None:
+            return
 
-        # Sanity check
-        res = glCheckFramebufferStatus(GL_FRAMEBUFFER)
-        assert res == GL_FRAMEBUFFER_COMPLETE, FB_ERROR_ENUMS.get(res, res)
+        if self.multi_fbo is not self.final_fbo:
+            glDeleteFramebuffers(1, byref(self.multi_fbo))
+        glDeleteFramebuffers(1, byref(self.final_fbo))
+        self.multi_fbo = None
+        self.final_fbo = None
 
-        # Enable depth testing
-        glEnable(GL_DEPTH_TEST)
+        for tex in self.textures:
+            glDeleteTextures(1, byref(tex))
+        self.textures = []
 
-        # Unbind the frame buffer
-        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        for rb in self.renderbuffers:
+            glDeleteRenderbuffers(1, byref(rb))
+        self.renderbuffers = []
 
-        # Array to render the image into (for observation rendering)
-        # The array is stored in column-major order
-        self.img_array = np.zeros(shape=(height, width, 3), dtype=np.uint8)
+        if self.pbos is not None:
+            glDeleteBuffers(self.num_pbos, self.pbos)
+            self.pbos = None
+        self.pending_pbos.clear()
 
     def bind(self):
         """
@@ -284,16 +886,36 @@ class FrameBuffer:
         """
 
         # Bind the multisampled frame buffer
-        glEnable(GL_MULTISAMPLE)
+        state = get_gl_state()
+        state.enable(GL_MULTISAMPLE)
         glBindFramebuffer(GL_FRAMEBUFFER, self.multi_fbo)
-        glViewport(0, 0, self.width, self.height)
+        state.set_viewport(0, 0, self.width, self.height)
+        state.disable(GL_SCISSOR_TEST)
 
-    def resolve(self):
+    def bind_viewport(self, x, y, width, height):
         """
-        Produce a numpy image array from the rendered image
+        Bind the frame buffer, restricting rendering and clearing
+        to a rectangular region of it (eg: one tile of an atlas)
         """
 
-        # Resolve the multisampled frame buffer into the final frame buffer
+        state = get_gl_state()
+        state.enable(GL_MULTISAMPLE)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.multi_fbo)
+        state.set_viewport(x, y, width, height)
+        state.set_scissor(x, y, width, height)
+        state.enable(GL_SCISSOR_TEST)
+
+    def _blit(self, mask, filter):
+        """
+        Resolve the multisampled frame buffer into the final frame buffer
+        """
+
+        # The scissor test also applies to blits
+        get_gl_state().disable(GL_SCISSOR_TEST)
+
+        if self.multi_fbo is self.final_fbo:
+            return
+
         glBindFramebuffer(GL_READ_FRAMEBUFFER, self.multi_fbo)
         glBindFramebuffer(GL_DRAW_FRAMEBUFFER, self.final_fbo)
         glBlitFramebuffer(
@@ -301,22 +923,42 @@ class FrameBuffer:
             self.width, self.height,
             0, 0,
             self.width, self.height,
-            GL_COLOR_BUFFER_BIT,
-            GL_LINEAR
+            mask,
+            filter
         )
 
-        # Resolve the depth component as well
-        glBlitFramebuffer(
-            0, 0,
-            self.width, self.height,
-            0, 0,
-            self.width, self.height,
-            GL_DEPTH_BUFFER_BIT,
-            GL_NEAREST
-        )
+    def _get_out_array(self, out):
+        """
+        Validate a caller-provided output array, or allocate one
+        """
+
+        if out is None:
+            return np.empty(shape=self.img_shape, dtype=np.uint8)
+
+        assert out.shape == self.img_shape, "output array must have shape {}".format(self.img_shape)
+        assert out.dtype == np.uint8, "output array must have dtype uint8"
+        assert out.flags['C_CONTIGUOUS'], "output array must be contiguous"
+
+        return out
+
+    def resolve(self, out=None):
+        """
+        Produce a numpy image array from the rendered image
+        If an output array is given, the pixels are written directly into it.
+        Note: the depth buffer is only resolved by get_depth_map
+        """
+
+        out = self._get_out_array(out)
+
+        # Resolve the multisampled frame buffer into the final frame buffer
+        self._blit(GL_COLOR_BUFFER_BIT, GL_LINEAR)
 
         # Copy the frame buffer contents into a numpy array
-        # Note: glReadPixels reads starting from the lower left corner
+        # Note: glReadPixels reads starting from the lower left corner,
+        # but the projection matrices flip the Y axis, so that the rows
+        # come out in top-to-bottom order without any flipping or copying.
+        # This is necessary for gym.wrappers.Monitor to record videos
+        # properly, otherwise they are vertically inverted.
         glBindFramebuffer(GL_FRAMEBUFFER, self.final_fbo)
         glPixelStorei(GL_PACK_ALIGNMENT, 1)
         glReadPixels(
@@ -326,20 +968,81 @@ class FrameBuffer:
             self.height,
             GL_RGB,
             GL_UNSIGNED_BYTE,
-            self.img_array.ctypes.data_as(POINTER(GLubyte))
+            out.ctypes.data_as(POINTER(GLubyte))
         )
 
         # Unbind the frame buffer
         glBindFramebuffer(GL_FRAMEBUFFER, 0)
 
-        # Flip the image because OpenGL maps (0,0) to the lower-left corner
-        # Note: this is necessary for gym.wrappers.Monitor to record videos
-        # properly, otherwise they are vertically inverted.
-        # Note: ascontiguousarray operates in constant time because it
-        # does not copy the data
-        img = np.ascontiguousarray(np.flip(self.img_array, axis=0))
+        return out
+
+    def read_async(self):
+        """
+        Start reading back the rendered image into a pixel buffer object,
+        without waiting for the GPU to finish rendering. The image is
+        retrieved later by calling collect(). Up to num_pbos readbacks
+        can be in flight at the same time.
+        """
+
+        assert len(self.pending_pbos) < self.num_pbos, \
+            "all pixel buffers are in use, call collect() first"
+
+        # Allocate the pixel buffer objects on first use
+        if self.pbos is None:
+            self.pbos = (GLuint * self.num_pbos)()
+            glGenBuffers(self.num_pbos, self.pbos)
+            for pbo in self.pbos:
+                glBindBuffer(GL_PIXEL_PACK_BUFFER, pbo)
+                glBufferData(GL_PIXEL_PACK_BUFFER, self.img_nbytes, None, GL_STREAM_READ)
+
+        pbo = self.pbos[self.next_pbo]
+        self.next_pbo = (self.next_pbo + 1) % self.num_pbos
+
+        # Resolve the multisampled frame buffer into the final frame buffer
+        self._blit(GL_COLOR_BUFFER_BIT, GL_LINEAR)
+
+        # Queue the copy of the pixels into the pixel buffer object
+        # With a pixel pack buffer bound, glReadPixels returns immediately
+        glBindFramebuffer(GL_FRAMEBUFFER, self.final_fbo)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, pbo)
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        glReadPixels(
+            0,
+            0,
+            self.width,
+            self.height,
+            GL_RGB,
+            GL_UNSIGNED_BYTE,
+            None
+        )
+
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
 
-        return img
+        self.pending_pbos.append(pbo)
+
+    def collect(self, out=None):
+        """
+        Produce a numpy image array from the oldest pending readback
+        started by read_async(). Only waits for that readback to complete.
+        If an output array is given, the pixels are written directly into it.
+        """
+
+        assert len(self.pending_pbos) > 0, "no pending readback, call read_async() first"
+
+        out = self._get_out_array(out)
+        pbo = self.pending_pbos.popleft()
+
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, pbo)
+        glGetBufferSubData(
+            GL_PIXEL_PACK_BUFFER,
+            0,
+            self.img_nbytes,
+            out.ctypes.data_as(POINTER(GLubyte))
+        )
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+        return out
 
     def get_depth_map(self, z_near=0.04, z_far=1.0):
         """
@@ -347,7 +1050,11 @@ class FrameBuffer:
         The values returned are real-world z-distance from the observer
         """
 
-        depth_map = np.zeros(shape=(self.height, self.width, 1), dtype=np.uint16)
+        # Resolve the multisampled depth buffer, which
+        # is skipped when rendering color observations
+        self._blit(GL_DEPTH_BUFFER_BIT, GL_NEAREST)
+
+        depth_map = np.empty(shape=(self.height, self.width, 1), dtype=np.uint16)
 
         glBindFramebuffer(GL_FRAMEBUFFER, self.final_fbo)
         glPixelStorei(GL_PACK_ALIGNMENT, 1)
@@ -364,19 +1071,224 @@ class FrameBuffer:
         # Unbind the frame buffer
         glBindFramebuffer(GL_FRAMEBUFFER, 0)
 
-        # Flip the depth map vertically to map OpenAI gym conventions
-        depth_map = np.flip(depth_map, axis=0)
+        # Note: the depth map does not need to be flipped vertically
+        # because the projection matrices already flip the Y axis
+
+        # Convert to real-world z-distances with a table lookup
+        return get_depth_lut(z_near, z_far)[depth_map]
 
+# Depth buffer lookup tables, indexed by (z_near, z_far)
+depth_luts = {}
+
+def get_depth_lut(z_near, z_far):
+    """
+    Get a table mapping each 16-bit depth buffer value to the
+    real-world z-distance from the observer, so that depth maps
+    can be linearized with a single gather instead of float math
+    over the whole image
+    """
+
+    key = (z_near, z_far)
+
+    if key not in depth_luts:
         # Transform into floating-point values
-        depth_map = depth_map.astype(np.float32) / 65535
+        depth = np.arange(65536, dtype=np.float64) / 65535
 
         # Convert to real-world z-distances
-        clip_z = (depth_map - 0.5) * 2.0;
+        clip_z = (depth - 0.5) * 2.0
         world_z = -2*z_far*z_near/(clip_z*(z_far-z_near)-(z_far+z_near))
 
-        depth_map = np.ascontiguousarray(world_z)
+        depth_luts[key] = world_z.astype(np.float32)
+
+    return depth_luts[key]
+
+def interleave_verts(verts, normals, texcs, colors=None):
+    """
+    Pack per-vertex positions, normals, texture coordinates and colors
+    into a single interleaved array, in the layout used by VertexBuffer
+    """
+
+    num_verts = verts.shape[0]
+    data = np.empty(shape=(num_verts, VertexBuffer.VERTEX_SIZE), dtype=np.float32)
+    data[:, 0:3] = verts
+    data[:, 3:6] = normals
+    data[:, 6:8] = texcs
+    data[:, 8:11] = colors if colors is not None else 1
+
+    return data
+
+class VertexBuffer:
+    """
+    Vertex buffer object holding interleaved vertex data.
+    Each vertex has a position, a normal, texture coordinates and a color.
+    """
+
+    # Number of floats per vertex
+    VERTEX_SIZE = 11
+
+    # Offsets of the vertex attributes, in floats
+    NORMAL_OFS = 3
+    TEXC_OFS = 6
+    COLOR_OFS = 8
 
-        return depth_map
+    def __init__(self, data=None, usage=GL_STATIC_DRAW):
+        self.vbo = GLuint(0)
+        glGenBuffers(1, byref(self.vbo))
+
+        # Usage hint, GL_DYNAMIC_DRAW for buffers updated frequently
+        self.usage = usage
+
+        self.num_verts = 0
+
+        # Number of vertices the buffer storage can hold
+        self.capacity = 0
+
+        if data is not None:
+            self.upload(data)
+
+    def upload(self, data):
+        """
+        Upload an array of interleaved vertex data (see interleave_verts)
+        """
+
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        assert len(data.shape) == 2 and data.shape[1] == self.VERTEX_SIZE
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferData(
+            GL_ARRAY_BUFFER,
+            data.nbytes,
+            data.ctypes.data_as(POINTER(GLfloat)),
+            self.usage
+        )
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+        self.num_verts = data.shape[0]
+        self.capacity = data.shape[0]
+
+    def append(self, data):
+        """
+        Append interleaved vertex data at the end of the buffer, growing
+        its storage as needed. Returns the index of the first new vertex.
+        """
+
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        assert len(data.shape) == 2 and data.shape[1] == self.VERTEX_SIZE
+
+        vert_bytes = self.VERTEX_SIZE * 4
+        first = self.num_verts
+        num_verts = first + data.shape[0]
+
+        # Double the capacity, copying the current contents on the GPU
+        if num_verts > self.capacity:
+            capacity = max(num_verts, 2 * self.capacity)
+
+            vbo = GLuint(0)
+            glGenBuffers(1, byref(vbo))
+            glBindBuffer(GL_COPY_WRITE_BUFFER, vbo)
+            glBufferData(GL_COPY_WRITE_BUFFER, capacity * vert_bytes, None, self.usage)
+
+            if first > 0:
+                glBindBuffer(GL_COPY_READ_BUFFER, self.vbo)
+                glCopyBufferSubData(
+                    GL_COPY_READ_BUFFER,
+                    GL_COPY_WRITE_BUFFER,
+                    0,
+                    0,
+                    first * vert_bytes
+                )
+                glBindBuffer(GL_COPY_READ_BUFFER, 0)
+
+            glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+            glDeleteBuffers(1, byref(self.vbo))
+            GLState.buffer_generation += 1
+            self.vbo = vbo
+            self.capacity = capacity
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferSubData(
+            GL_ARRAY_BUFFER,
+            first * vert_bytes,
+            data.nbytes,
+            data.ctypes.data_as(POINTER(GLfloat))
+        )
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+        self.num_verts = num_verts
+
+        return first
+
+    def bind(self):
+        """
+        Set up the vertex array pointers for this buffer, if they are not
+        already (see GLState.bind_vertex_buffer)
+        """
+
+        get_gl_state().bind_vertex_buffer(self)
+
+    def draw(self, mode=GL_TRIANGLES, first=0, count=None):
+        """
+        Draw a range of vertices from the buffer
+        """
+
+        if count is None:
+            count = self.num_verts - first
+
+        self.bind()
+        glDrawArrays(mode, first, count)
+
+    def draw_multi(self, firsts, counts, mode=GL_TRIANGLES):
+        """
+        Draw several ranges of vertices from the buffer with one call
+        """
+
+        firsts = np.ascontiguousarray(firsts, dtype=np.int32)
+        counts = np.ascontiguousarray(counts, dtype=np.int32)
+
+        self.bind()
+        glMultiDrawArrays(
+            mode,
+            firsts.ctypes.data_as(POINTER(GLint)),
+            counts.ctypes.data_as(POINTER(GLsizei)),
+            len(firsts)
+        )
+
+    def delete(self):
+        glDeleteBuffers(1, byref(self.vbo))
+        GLState.buffer_generation += 1
+        self.vbo = GLuint(0)
+        self.num_verts = 0
+        self.capacity = 0
+
+def draw_ranges(draws, mode=GL_TRIANGLES):
+    """
+    Draw a sequence of (vertex buffer, texture, first, count) ranges of
+    vertices, where the texture may be None. The buffer and texture are
+    only rebound when they differ from those of the previous range, so
+    sorting the ranges by texture minimizes state changes.
+    Texturing is disabled afterwards.
+    """
+
+    state = get_gl_state()
+    cur_vbuf = None
+    cur_tex = None
+
+    for vbuf, tex, first, count in draws:
+        if vbuf is not cur_vbuf:
+            vbuf.bind()
+            cur_vbuf = vbuf
+
+        if tex:
+            state.enable(GL_TEXTURE_2D)
+            if tex is not cur_tex:
+                glBindTexture(tex.target, tex.id)
+                cur_tex = tex
+        else:
+            state.disable(GL_TEXTURE_2D)
+
+        glDrawArrays(mode, first, count)
+
+    state.disable(GL_TEXTURE_2D)
 
 def drawAxes(len=0.1):
     """
@@ -450,3 +1362,42 @@ def drawBox(
     glVertex3f(x_min, y_min, z_min)
 
     glEnd()
+
+def gen_box_data(
+    x_min,
+    x_max,
+    y_min,
+    y_max,
+    z_min,
+    z_max
+):
+    """
+    Generate the triangles of a 3D box, with the same faces as drawBox,
+    as an interleaved vertex array (see interleave_verts)
+    """
+
+    # Corners of each face, in the order drawn by drawBox
+    quads = np.array([
+        [[x_max, y_max, z_max], [x_min, y_max, z_max], [x_min, y_min, z_max], [x_max, y_min, z_max]],
+        [[x_min, y_max, z_min], [x_max, y_max, z_min], [x_max, y_min, z_min], [x_min, y_min, z_min]],
+        [[x_min, y_max, z_max], [x_min, y_max, z_min], [x_min, y_min, z_min], [x_min, y_min, z_max]],
+        [[x_max, y_max, z_min], [x_max, y_max, z_max], [x_max, y_min, z_max], [x_max, y_min, z_min]],
+        [[x_max, y_max, z_max], [x_max, y_max, z_min], [x_min, y_max, z_min], [x_min, y_max, z_max]],
+        [[x_max, y_min, z_min], [x_max, y_min, z_max], [x_min, y_min, z_max], [x_min, y_min, z_min]],
+    ])
+    normals = np.array([
+        [0, 0, 1],
+        [0, 0, -1],
+        [-1, 0, 0],
+        [1, 0, 0],
+        [0, 1, 0],
+        [0, -1, 0],
+    ])
+
+    # Split each quad into two triangles
+    tri_idxs = [0, 1, 2, 0, 2, 3]
+    verts = quads[:, tri_idxs, :].reshape(-1, 3)
+    normals = np.repeat(normals, len(tri_idxs), axis=0)
+    texcs = np.zeros(shape=(verts.shape[0], 2))
+
+    return interleave_verts(verts, normals, texcs)
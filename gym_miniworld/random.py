@@ -39,6 +39,13 @@ class RandGen:
         idx = self.np_random.choice(len(lst), p=probs)
         return lst[idx]
 
+    def choice_idxs(self, num_elems, size, probs=None):
+        """
+        Pick an array of random indices into a list of num_elems elements
+        """
+
+        return self.np_random.choice(num_elems, size=size, p=probs)
+
     def color(self):
         """
         Pick a random color name
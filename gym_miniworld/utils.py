@@ -1,3 +1,4 @@
+import hashlib
 import os
 
 def get_subdir_path(sub_dir):
@@ -33,3 +34,74 @@ def get_file_path(sub_dir, file_name, default_ext):
         file_path += '.' + default_ext
 
     return file_path
+
+def get_cache_dir(sub_dir):
+    """
+    Get the path of a directory in which derived data (eg: decoded
+    textures) can be cached between runs, creating it if needed.
+
+    The cache is stored under MINIWORLD_CACHE_DIR, or ~/.cache/gym-miniworld
+    by default. Setting MINIWORLD_CACHE_DIR to an empty string disables
+    caching, in which case None is returned.
+    """
+
+    cache_root = os.environ.get(
+        'MINIWORLD_CACHE_DIR',
+        os.path.join(os.path.expanduser('~'), '.cache', 'gym-miniworld')
+    )
+
+    if not cache_root:
+        return None
+
+    dir_path = os.path.join(cache_root, sub_dir)
+
+    try:
+        os.makedirs(dir_path, exist_ok=True)
+    except OSError:
+        return None
+
+    return dir_path
+
+def get_cache_path(sub_dir, src_paths, ext, version):
+    """
+    Get the path of the cache entry holding data derived from some source
+    files. Entries are keyed by the path, size and modification time of
+    the source files, so that they are not used once these change.
+    Returns None if caching is disabled.
+    """
+
+    cache_dir = get_cache_dir(sub_dir)
+    if cache_dir is None:
+        return None
+
+    key = [str(version)]
+    for src_path in src_paths:
+        src_path = os.path.realpath(src_path)
+        stat = os.stat(src_path)
+        key.append('%s:%d:%d' % (src_path, stat.st_size, stat.st_mtime_ns))
+
+    file_name, _ = os.path.splitext(os.path.basename(src_paths[0]))
+    digest = hashlib.sha1('\n'.join(key).encode('utf-8')).hexdigest()[:16]
+
+    return os.path.join(cache_dir, '%s-%s.%s' % (file_name, digest, ext))
+
+def write_cache(cache_path, write_fn):
+    """
+    Write a cache entry by calling write_fn with a file open for writing.
+    The data goes to a temporary file first, so that processes reading
+    the cache concurrently never see a partially written entry.
+    Failures, including errors raised by write_fn, are ignored, the cache
+    being an optimization only, and the temporary file is then removed.
+    """
+
+    tmp_path = '%s.%d.tmp' % (cache_path, os.getpid())
+
+    try:
+        with open(tmp_path, 'wb') as f:
+            write_fn(f)
+        os.replace(tmp_path, cache_path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
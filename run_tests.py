@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
 
 import os
+import tempfile
 import numpy as np
 import math
 import gym
 import gym_miniworld
 from gym_miniworld.wrappers import PyTorchObsWrapper, GreyscaleWrapper
+from gym_miniworld.batched import BatchedMiniWorld
 from gym_miniworld.entity import TextFrame
+from gym_miniworld.math import intersect_circle_segs
+from gym_miniworld.opengl import load_mipmaps, enable_gl_call_count, get_gl_call_count
+from gym_miniworld.utils import get_file_path, write_cache
 
 env = gym.make('MiniWorld-Hallway-v0')
 
@@ -27,6 +32,160 @@ second_obs, _, _, _ = env.step(0)
 assert first_obs.shape == env.observation_space.shape
 assert first_obs.shape == second_obs.shape
 
+# Check that asynchronous rendering produces the same observation
+env.unwrapped.async_obs = True
+assert env.step(0)[0] is None
+assert np.array_equal(env.collect_obs(), env.render_obs())
+env.unwrapped.async_obs = False
+
+# Check that batched rendering matches the individual observations
+batch = BatchedMiniWorld('MiniWorld-Hallway-v0', 3)
+batch.seed(0)
+batch_obs = batch.reset()
+batch_obs, _, _, _ = batch.step([0, 1, 2])
+assert batch_obs.shape == (3,) + batch.observation_space.shape
+for env_idx, batch_env in enumerate(batch.envs):
+    assert np.abs(batch_obs[env_idx].astype(int) - batch_env.render_obs()).max() <= 1
+batch.close()
+batch = BatchedMiniWorld('MiniWorld-TwoRoomSmall-v0', 3, use_atlas=False)
+batch.seed(0)
+batch_obs = batch.reset()
+for env_idx, batch_env in enumerate(batch.envs):
+    assert np.array_equal(batch_obs[env_idx], batch_env.render_obs())
+batch.close()
+
+# Check the observation modalities
+mod_env = gym.make('MiniWorld-OneRoom-v0', obs_modalities=('rgb', 'depth', 'seg'))
+obs = mod_env.reset()
+assert mod_env.observation_space.contains(obs)
+assert np.array_equal(obs['rgb'], mod_env.render_obs())
+assert np.array_equal(obs['depth'], mod_env.render_depth())
+num_ids = 1 + len(mod_env.rooms) + len(mod_env.entities)
+assert set(np.unique(obs['seg'])) <= set(range(num_ids))
+mod_env.unwrapped.async_obs = True
+try:
+    mod_env.step(0)
+    assert False
+except ValueError:
+    pass
+mod_env.close()
+
+# Check that the OpenGL calls are counted, and that skipping
+# redundant state changes leaves repeated observations unchanged
+env.reset()
+enable_gl_call_count()
+get_gl_call_count(reset=True)
+obs = env.render_obs()
+assert get_gl_call_count() > 0
+enable_gl_call_count(False)
+assert np.array_equal(env.render_obs(), obs)
+
+# Check that environments sharing the OpenGL context don't
+# overwrite each other's scene, including after one is closed
+env_a = gym.make('MiniWorld-Hallway-v0')
+obs_a = env_a.render_obs()
+env_b = gym.make('MiniWorld-ThreeRooms-v0')
+env_b.reset()
+assert np.array_equal(env_a.render_obs(), obs_a)
+env_b.close()
+env_b.close()
+env_c = gym.make('MiniWorld-Maze-v0')
+assert np.array_equal(env_a.render_obs(), obs_a)
+env_a.close()
+env_c.close()
+
+# Check that cached texture mipmaps match freshly decoded ones
+tex_path = get_file_path('textures', 'cardboard_4', 'png')
+cached = load_mipmaps(tex_path)
+cache_dir = os.environ.get('MINIWORLD_CACHE_DIR', None)
+os.environ['MINIWORLD_CACHE_DIR'] = ''
+decoded = load_mipmaps(tex_path)
+if cache_dir is None:
+    del os.environ['MINIWORLD_CACHE_DIR']
+else:
+    os.environ['MINIWORLD_CACHE_DIR'] = cache_dir
+assert len(cached) == len(decoded) and decoded[-1].shape == (1, 1, 3)
+assert all(np.array_equal(a, b) for a, b in zip(cached, decoded))
+
+# Check that failed cache writes are ignored and leave no files behind
+def failing_write(f):
+    f.write(b'partial')
+    raise ValueError()
+tmp_dir = tempfile.mkdtemp()
+write_cache(os.path.join(tmp_dir, 'entry.npy'), failing_write)
+assert os.listdir(tmp_dir) == []
+os.rmdir(tmp_dir)
+
+# Check that capping the texture resolution leaves observations unchanged
+env_a = gym.make('MiniWorld-Hallway-v0')
+env_b = gym.make('MiniWorld-Hallway-v0', max_tex_size='auto')
+assert env_b.unwrapped.max_tex_size == 512
+env_a.seed(0)
+env_b.seed(0)
+assert np.array_equal(env_a.reset(), env_b.reset())
+env_a.close()
+env_b.close()
+
+# Check that the static data is reused when the floorplan is unchanged
+env_a = gym.make('MiniWorld-FourRooms-v0')
+wall_segs = env_a.unwrapped.wall_segs
+env_a.seed(0)
+obs_a = env_a.reset()
+assert env_a.unwrapped.wall_segs is wall_segs
+env_a.unwrapped.layout_cache = None
+env_a.seed(0)
+assert np.array_equal(env_a.reset(), obs_a)
+assert env_a.unwrapped.wall_segs is not wall_segs
+env_a.close()
+
+# Check that the wall segment grid and the occupancy grid find
+# the same collisions as testing against all the wall segments
+env_a = gym.make('MiniWorld-Maze-v0', occupancy_cell_size=0.1)
+env_a = env_a.unwrapped
+rng = np.random.RandomState(0)
+for _ in range(500):
+    pos = np.array([
+        rng.uniform(env_a.min_x - 1, env_a.max_x + 1),
+        0,
+        rng.uniform(env_a.min_z - 1, env_a.max_z + 1)
+    ])
+    radius = rng.uniform(0.05, 2)
+    hit = intersect_circle_segs(pos, radius, env_a.wall_segs)
+    assert env_a.wall_grid.intersect_circle(pos, radius) == hit
+    assert env_a.occupancy.intersect_circle(pos, radius) == hit
+free_space = env_a.occupancy.get_free_space(env_a.agent.radius)
+assert free_space.shape == (env_a.occupancy.num_z, env_a.occupancy.num_x)
+assert free_space[env_a.occupancy.get_cell(env_a.agent.pos)[::-1]]
+for ent in env_a.entities:
+    assert not env_a.intersect(ent, ent.pos, ent.radius)
+env_a.close()
+
+# Check that the spatial hash of the entities follows them
+# as they move and as they are removed
+env_a = gym.make('MiniWorld-PutNext-v0').unwrapped
+ent = env_a.entities[0]
+far_pos = np.array([100, 0, 100])
+ent.pos = far_pos
+assert env_a.entities.within(far_pos, 0.1) == [ent]
+assert env_a.intersect(env_a.agent, far_pos, 0.1) is ent
+env_a.entities.remove(ent)
+assert env_a.entities.within(far_pos, 0.1) == []
+env_a.close()
+
+# Check that placed entities are clear of the walls and of each other,
+# and that placing an entity with no free space left raises an error
+env_a = gym.make('MiniWorld-CollectHealth-v0').unwrapped
+env_a.seed(0)
+env_a.reset()
+for ent in env_a.entities:
+    assert not env_a.intersect(ent, ent.pos, ent.radius)
+try:
+    env_a.place_entity(gym_miniworld.entity.Box(color='red', size=20))
+    assert False
+except RuntimeError:
+    pass
+env_a.close()
+
 # Test the PyTorch observation wrapper
 env = PyTorchObsWrapper(env)
 first_obs = env.reset()
@@ -46,6 +205,23 @@ class TestText(gym_miniworld.envs.threerooms.ThreeRooms):
         ))
 env = TestText()
 
+# Check that baked text textures evicted from the cache are
+# released, but not while a TextFrame still uses them
+frame = TextFrame(pos=[0, 1.35, 7], dir=0, str='in use')
+frame.randomize(None, None)
+frame_tex = frame.tex
+frames = [TextFrame(pos=[0, 1.35, 7], dir=0, str=str(i)) for i in range(100)]
+for f in frames:
+    f.randomize(None, None)
+texs = [f.tex for f in frames]
+del frames, f
+assert frame_tex not in TextFrame.text_cache.values()
+assert frame_tex.tex.id != 0
+num_released = sum(tex.tex.id == 0 for tex in texs)
+assert num_released == len(texs) - TextFrame.text_cache_size
+del frame
+assert frame_tex.tex.id == 0
+
 # Basic collision detection test
 # Make sure the agent can never get outside of the room
 env = gym.make('MiniWorld-OneRoom-v0')
@@ -58,6 +234,11 @@ for _ in range(30):
         assert x >= room.min_x and x <= room.max_x
         assert z >= room.min_z and z <= room.max_z
 
+# Check that long moves can't go through walls
+assert not env.move_agent(2 * room.max_x, 0)
+x, _, z = env.agent.pos
+assert x >= room.min_x and x <= room.max_x
+
 # Try loading each of the available environments
 for env_id in gym_miniworld.envs.env_ids:
     if 'RemoteBot' in env_id:
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+"""
+Measure the time taken by entity intersection queries and entity moves,
+with the spatial hash of EntityList and with a linear scan of the
+entities (the previous implementation of MiniWorldEnv.intersect)
+"""
+
+import argparse
+import time
+import numpy as np
+import gym_miniworld
+from gym_miniworld.entity import Box, EntityList
+
+# scripts/benchmark_entities.py --num-ents 100 1000 --size 40
+parser = argparse.ArgumentParser(description='Benchmark entity intersection queries')
+parser.add_argument('--num-ents', type=int, nargs='+', default=[100, 300, 1000], help='numbers of entities to test')
+parser.add_argument('--size', type=float, default=40, help='side of the square area the entities are placed in, in meters')
+parser.add_argument('--num-queries', type=int, default=2000, help='number of timed queries')
+args = parser.parse_args()
+
+def linear_intersect(ents, ent, pos, radius):
+    px, _, pz = pos
+    pos = np.array([px, 0, pz])
+
+    for ent2 in ents:
+        if ent2 is ent:
+            continue
+
+        px, _, pz = ent2.pos
+        pos2 = np.array([px, 0, pz])
+
+        d = np.linalg.norm(pos2 - pos)
+        if d < radius + ent2.radius:
+            return ent2
+
+    return None
+
+def time_per_call(fn, items):
+    t0 = time.time()
+    for item in items:
+        fn(*item)
+    return 1e6 * (time.time() - t0) / len(items)
+
+rng = np.random.RandomState(0)
+
+print('%8s %12s %12s %12s' % ('entities', 'linear us', 'hash us', 'move us'))
+
+for num_ents in args.num_ents:
+    ents = EntityList()
+    for _ in range(num_ents):
+        ent = Box(color='red', size=rng.uniform(0.3, 1.0))
+        ent.pos = np.array([rng.uniform(0, args.size), 0, rng.uniform(0, args.size)])
+        ents.append(ent)
+
+    queries = [
+        (None, np.array([rng.uniform(0, args.size), 0, rng.uniform(0, args.size)]), 0.4)
+        for _ in range(args.num_queries)
+    ]
+
+    for ent, pos, radius in queries:
+        assert ents.intersect(pos, radius) is linear_intersect(ents, ent, pos, radius)
+
+    linear_time = time_per_call(lambda ent, pos, radius: linear_intersect(ents, ent, pos, radius), queries)
+    hash_time = time_per_call(lambda ent, pos, radius: ents.intersect(pos, radius, exclude=ent), queries)
+
+    # Move random entities, which updates the spatial hash
+    moves = [(ents[rng.randint(num_ents)], pos) for _, pos, _ in queries]
+    def move(ent, pos):
+        ent.pos = pos
+    move_time = time_per_call(move, moves)
+
+    print('%8d %12.1f %12.1f %12.1f' % (num_ents, linear_time, hash_time, move_time))
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+"""
+Measure the time taken to load each of the meshes in gym_miniworld/meshes,
+both when parsing the OBJ file and when reading from the mesh cache
+"""
+
+import argparse
+import glob
+import os
+import tempfile
+import time
+import gym_miniworld
+from gym_miniworld.objmesh import ObjMesh
+from gym_miniworld.utils import get_subdir_path
+
+# scripts/benchmark_meshes.py --repeats 5
+parser = argparse.ArgumentParser(description='Benchmark the loading of OBJ meshes')
+parser.add_argument('--repeats', type=int, default=3, help='number of timed loads per mesh (the best is kept)')
+args = parser.parse_args()
+
+mesh_paths = sorted(glob.glob(os.path.join(get_subdir_path('meshes'), '*.obj')))
+
+def best_time(fn):
+    best = float('inf')
+    for _ in range(args.repeats):
+        t0 = time.time()
+        fn()
+        best = min(best, time.time() - t0)
+    return 1000 * best
+
+# Use an empty mesh cache, so that the first load of each mesh parses it
+# and writes its cache entry. Only the parsing and the reading of the
+# cache entry are timed, not the uploading of the vertices to the GPU.
+cache_dir = tempfile.mkdtemp()
+os.environ['MINIWORLD_CACHE_DIR'] = cache_dir
+
+print('%-24s %8s %10s %10s' % ('mesh', 'faces', 'parse ms', 'cached ms'))
+
+total_parse = 0
+total_cached = 0
+
+for mesh_path in mesh_paths:
+    mesh = ObjMesh(mesh_path)
+    num_faces = sum(len(data) for data in mesh.chunk_data) // 3
+    materials = mesh._load_mtl(mesh_path)
+    cache_path = ObjMesh._get_cache_path(mesh_path)
+
+    parse_time = best_time(lambda: ObjMesh._parse_obj(mesh_path, materials))
+    cached_time = best_time(lambda: ObjMesh._load_cache(cache_path))
+    total_parse += parse_time
+    total_cached += cached_time
+
+    print('%-24s %8d %10.2f %10.2f' % (
+        os.path.basename(mesh_path),
+        num_faces,
+        parse_time,
+        cached_time
+    ))
+
+print('%-24s %8s %10.2f %10.2f' % ('total', '', total_parse, total_cached))